@@ -0,0 +1,313 @@
+"""Time the core operations of carehome on a synthetic world, so that changes
+can be compared across commits.
+
+Each benchmark builds its own world of --objects objects, whose ancestors form
+a hierarchy --depth levels deep and --width objects wide, where every object
+has all the objects on the level above as parents. The best of --repeat runs
+is reported. Use --json to save the results, and --compare to show the
+change from a previous run.
+
+Usage: python benchmarks/core.py [--objects N] [--depth N] [--width N]
+       [--repeat N] [--only NAME ...] [--json FILE] [--compare FILE]
+"""
+
+import json
+import os.path
+import platform
+import subprocess
+from argparse import ArgumentParser
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from carehome import Database
+
+parser = ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument(
+    '--objects', type=int, default=10000, help='The number of objects to make'
+)
+parser.add_argument(
+    '--depth', type=int, default=5,
+    help='The number of levels of ancestors above each object'
+)
+parser.add_argument(
+    '--width', type=int, default=2,
+    help='The number of ancestors on each level'
+)
+parser.add_argument(
+    '--repeat', type=int, default=3,
+    help='The number of times to run each benchmark'
+)
+parser.add_argument(
+    '--only', nargs='+', metavar='NAME', help='The benchmarks to run'
+)
+parser.add_argument(
+    '--json', metavar='FILE', help='Write the results to FILE as JSON'
+)
+parser.add_argument(
+    '--compare', metavar='FILE',
+    help='Compare the results with those in FILE, as written by --json'
+)
+
+methods_dir = TemporaryDirectory()
+benchmarks = {}
+
+
+def benchmark(func):
+    """Register func as a benchmark. It will be called with a World instance
+    and the parsed arguments, and should return the number of operations it
+    timed and the time they took."""
+    benchmarks[func.__name__] = func
+    return func
+
+
+class World:
+    """A database with a hierarchy of ancestors. The object at the top of
+    the hierarchy is root, and the objects on the bottom level are leaves."""
+
+    def __init__(self, depth, width):
+        self.db = Database(methods_dir=methods_dir.name)
+        self.root = self.db.create_object()
+        self.root.name = 'Root'
+        self.root.add_method('def describe(self):\n    return self.name')
+        self.root.add_method('def on_test(self, value):\n    return value')
+        self.leaves = [self.root]
+        for level in range(depth):
+            self.leaves = [
+                self.db.create_object(*self.leaves) for x in range(width)
+            ]
+
+    def populate(self, count):
+        """Return a list of count new objects, each a child of every leaf."""
+        return [self.db.create_object(*self.leaves) for x in range(count)]
+
+
+def timed(func, *args):
+    """Return the time taken to call func with args, in seconds."""
+    started = perf_counter()
+    func(*args)
+    return perf_counter() - started
+
+
+@benchmark
+def create_object(world, args):
+    db = world.db
+    leaves = world.leaves
+
+    def run():
+        for x in range(args.objects):
+            db.create_object(*leaves)
+
+    return (args.objects, timed(run))
+
+
+@benchmark
+def add_parent(world, args):
+    objects = world.populate(args.objects)
+    mixin = world.db.create_object()
+
+    def run():
+        for obj in objects:
+            obj.add_parent(mixin)
+
+    return (len(objects), timed(run))
+
+
+@benchmark
+def resolve_cold(world, args):
+    objects = world.populate(args.objects)
+
+    def run():
+        for obj in objects:
+            obj.name
+
+    return (len(objects), timed(run))
+
+
+@benchmark
+def resolve_warm(world, args):
+    objects = world.populate(args.objects)
+    for obj in objects:
+        obj.name
+
+    def run():
+        for obj in objects:
+            obj.name
+
+    return (len(objects), timed(run))
+
+
+@benchmark
+def call_method(world, args):
+    objects = world.populate(args.objects)
+    for obj in objects:
+        obj.describe()
+
+    def run():
+        for obj in objects:
+            obj.describe()
+
+    return (len(objects), timed(run))
+
+
+@benchmark
+def set_property(world, args):
+    objects = world.populate(args.objects)
+
+    def run():
+        for x, obj in enumerate(objects):
+            obj.name = 'Object %d' % x
+
+    return (len(objects), timed(run))
+
+
+@benchmark
+def contents(world, args):
+    rooms = [world.db.create_object() for x in range(100)]
+    for x, obj in enumerate(world.populate(args.objects)):
+        obj.location = rooms[x % len(rooms)]
+
+    def run():
+        for room in rooms:
+            room.contents
+
+    return (len(rooms), timed(run))
+
+
+@benchmark
+def move(world, args):
+    objects = world.populate(args.objects)
+    room = world.db.create_object()
+
+    def run():
+        for obj in objects:
+            obj.location = room
+
+    return (len(objects), timed(run))
+
+
+@benchmark
+def destroy_object(world, args):
+    objects = world.populate(args.objects)
+    db = world.db
+
+    def run():
+        for obj in objects:
+            db.destroy_object(obj)
+
+    return (len(objects), timed(run))
+
+
+@benchmark
+def add_method(world, args):
+    objects = world.populate(args.objects)
+
+    def run():
+        for obj in objects:
+            obj.add_method('def greet(self):\n    return "Hello."')
+
+    return (len(objects), timed(run))
+
+
+@benchmark
+def dump(world, args):
+    for x, obj in enumerate(world.populate(args.objects)):
+        obj.weight = x
+
+    return (len(world.db.objects), timed(world.db.dump))
+
+
+@benchmark
+def load(world, args):
+    for x, obj in enumerate(world.populate(args.objects)):
+        obj.weight = x
+    d = world.db.dump()
+
+    def run():
+        Database(methods_dir=methods_dir.name).load(d)
+
+    return (len(d['objects']), timed(run))
+
+
+@benchmark
+def event_dispatch(world, args):
+    objects = world.populate(args.objects)
+    for obj in objects:
+        obj.try_event('on_test', 0)
+
+    def run():
+        for obj in objects:
+            obj.try_event('on_test', 1)
+
+    return (len(objects), timed(run))
+
+
+def git_commit():
+    """Return the git commit which is checked out, or None."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(func, args):
+    """Run func args.repeat times, each on a new world, and return a
+    dictionary of results from the fastest run."""
+    best = None
+    for x in range(args.repeat):
+        operations, taken = func(World(args.depth, args.width), args)
+        if best is None or taken < best[1]:
+            best = (operations, taken)
+    operations, taken = best
+    return dict(
+        operations=operations, seconds=taken,
+        per_second=operations / taken if taken else None
+    )
+
+
+def main():
+    args = parser.parse_args()
+    names = args.only or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            parser.error(
+                'Unknown benchmark %r. Choose from: %s.' % (
+                    name, ', '.join(benchmarks)
+                )
+            )
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)['results']
+    results = {}
+    print('%-16s %12s %12s %14s %8s' % (
+        'benchmark', 'operations', 'seconds', 'per second', 'change'
+    ))
+    for name in names:
+        result = run_benchmark(benchmarks[name], args)
+        results[name] = result
+        change = ''
+        old = previous.get(name, {}).get('per_second', None)
+        if old and result['per_second']:
+            change = '%+.1f%%' % ((result['per_second'] / old - 1) * 100)
+        print('%-16s %12d %12.4f %14.0f %8s' % (
+            name, result['operations'], result['seconds'],
+            result['per_second'] or 0, change
+        ))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(
+                dict(
+                    commit=git_commit(), date=datetime.utcnow().isoformat(),
+                    python=platform.python_version(), objects=args.objects,
+                    depth=args.depth, width=args.width, repeat=args.repeat,
+                    results=results
+                ), f, indent=4, sort_keys=True
+            )
+
+
+if __name__ == '__main__':
+    main()
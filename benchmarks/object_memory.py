@@ -0,0 +1,84 @@
+"""Compare the memory used by a world built from Object and Property against
+one built from CompactObject and CompactProperty.
+
+Each world is built in a fresh process, and memory is measured as the growth
+in that process's peak resident set size, so this only runs on Unix.
+
+Usage: python benchmarks/object_memory.py [--objects N]
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from resource import getrusage, RUSAGE_SELF
+from sys import platform
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from carehome import (
+    Database, Object, Property, CompactObject, CompactProperty
+)
+
+parser = ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument(
+    '--objects', type=int, default=1000000,
+    help='The number of objects to make'
+)
+
+methods_dir = TemporaryDirectory()
+
+
+def build_world(count, object_class, property_class):
+    """Return a database containing count objects, each with a parent, a
+    location and two properties."""
+    db = Database(
+        methods_dir=methods_dir.name, object_class=object_class,
+        property_class=property_class
+    )
+    base = db.create_object()
+    base.add_method('def describe(self):\n    return self.name')
+    base.name = 'Thing'
+    room = db.create_object(base)
+    for x in range(count):
+        o = db.create_object(base)
+        o.location = room
+        o.name = 'Object %d' % x
+        o.weight = float(x)
+    return db
+
+
+def measure(count, object_class, property_class):
+    """Return (bytes, seconds) taken to build a world of count objects."""
+    before = getrusage(RUSAGE_SELF).ru_maxrss
+    started = perf_counter()
+    db = build_world(count, object_class, property_class)
+    taken = perf_counter() - started
+    used = getrusage(RUSAGE_SELF).ru_maxrss - before
+    del db
+    if platform != 'darwin':
+        used *= 1024  # Linux reports kilobytes.
+    return (used, taken)
+
+
+def main():
+    args = parser.parse_args()
+    print(
+        '%-10s %12s %12s %12s' % (
+            'classes', 'memory (MB)', 'bytes/obj', 'build (s)'
+        )
+    )
+    for name, object_class, property_class in (
+        ('standard', Object, Property),
+        ('compact', CompactObject, CompactProperty)
+    ):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            used, taken = executor.submit(
+                measure, args.objects, object_class, property_class
+            ).result()
+        print(
+            '%-10s %12.1f %12d %12.2f' % (
+                name, used / 1024 / 1024, used / args.objects, taken
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
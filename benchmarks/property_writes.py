@@ -0,0 +1,88 @@
+"""Measure how many property assignments per second Object.__setattr__ can
+handle, compared with the implementation which called dir() on every
+assignment.
+
+Usage: python benchmarks/property_writes.py [--objects N] [--writes N]
+"""
+
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from carehome import Database, Object
+
+parser = ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument(
+    '--objects', type=int, default=1000, help='The number of objects to make'
+)
+parser.add_argument(
+    '--writes', type=int, default=100,
+    help='The number of times to set a property on each object'
+)
+
+methods_dir = TemporaryDirectory()
+
+
+class LegacyObject(Object):
+    """An Object which sets attributes the old way, for comparison."""
+
+    def __setattr__(self, name, value):
+        initialised = self.__dict__.get('__initialised__', False)
+        reserved_names = ('__initialised__', 'id')
+        if initialised and name in reserved_names:
+            raise RuntimeError(
+                'You cannot set this attribute after initialisation.'
+            )
+        if not initialised or (
+            name in self.__dict__ or name in dir(self.database.object_class)
+        ):
+            return object.__setattr__(self, name, value)
+        elif name in self._properties:
+            self._properties[name].set(value)
+        else:
+            prop = self.find_property(name)
+            if prop is None:
+                t = type(value)
+                description = 'Added by __setattr__.'
+            else:
+                t = prop.type
+                description = prop.description
+            self.add_property(name, t, value, description=description)
+
+
+def build_world(count, object_class):
+    """Return a list of count objects, whose shared ancestors have properties
+    which the objects will override."""
+    db = Database(methods_dir=methods_dir.name, object_class=object_class)
+    base = db.create_object()
+    base.hp = 100
+    base.name = 'Thing'
+    middle = db.create_object(base)
+    return [db.create_object(middle) for x in range(count)]
+
+
+def main():
+    args = parser.parse_args()
+    print(
+        '%-8s %16s %16s' % ('object', 'override (w/s)', 'existing (w/s)')
+    )
+    for object_class in (LegacyObject, Object):
+        objects = build_world(args.objects, object_class)
+        started = perf_counter()
+        for x, obj in enumerate(objects):
+            obj.hp = x
+        override = len(objects) / (perf_counter() - started)
+        started = perf_counter()
+        for x in range(args.writes):
+            for obj in objects:
+                obj.hp = x
+        existing = len(objects) * args.writes / (perf_counter() - started)
+        print(
+            '%-8s %16d %16d' % (
+                'legacy' if object_class is LegacyObject else 'current',
+                override, existing
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Compare the speed and size of binary snapshots against Database.dump
+followed by YAML or JSON.
+
+Usage: python benchmarks/snapshot_formats.py [--objects N]
+"""
+
+import json
+import os
+import os.path
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from carehome import Database
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+parser = ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument(
+    '--objects', type=int, default=10000, help='The number of objects to make'
+)
+
+
+methods_dir = TemporaryDirectory()
+
+
+def build_world(count):
+    """Return a database containing count objects."""
+    db = Database(methods_dir=methods_dir.name)
+    base = db.create_object()
+    base.add_method('def describe(self):\n    return self.name')
+    room = db.create_object(base)
+    for x in range(count):
+        o = db.create_object(base)
+        o.location = room
+        o.name = 'Object %d' % x
+        o.weight = x / 10
+        o.created = datetime(2018, 1, 1) + timedelta(seconds=x)
+        o.friends = [room, base]
+    return db
+
+
+def json_dump(db, filename):
+    d = db.dump()
+    for data in d['objects']:
+        for datum in data['properties']:
+            datum['value'] = db.encode_json_value(datum['value'])
+    with open(filename, 'w') as f:
+        json.dump(d, f)
+
+
+def json_load(filename):
+    db = Database(methods_dir=methods_dir.name)
+    with open(filename, 'r') as f:
+        d = json.load(f)
+    for data in d['objects']:
+        for datum in data['properties']:
+            datum['value'] = db.decode_json_value(datum['value'])
+    db.load(d)
+
+
+def yaml_dump(db, filename):
+    with open(filename, 'w') as f:
+        yaml.dump(db.dump(), f, Dumper=getattr(yaml, 'CDumper', yaml.Dumper))
+
+
+def yaml_load(filename):
+    with open(filename, 'r') as f:
+        d = yaml.load(f, Loader=getattr(yaml, 'CLoader', yaml.Loader))
+    Database(methods_dir=methods_dir.name).load(d)
+
+
+def binary_dump(db, filename):
+    db.save_binary(filename)
+
+
+def binary_load(filename):
+    Database(methods_dir=methods_dir.name).load_binary(filename)
+
+
+def timed(func, *args):
+    """Return the time taken to call func with args, in seconds."""
+    started = perf_counter()
+    func(*args)
+    return perf_counter() - started
+
+
+def main():
+    args = parser.parse_args()
+    db = build_world(args.objects)
+    formats = [
+        ('binary', binary_dump, binary_load), ('json', json_dump, json_load)
+    ]
+    if yaml is None:
+        print('PyYAML is not installed, so YAML will be skipped.')
+    else:
+        formats.append(('yaml', yaml_dump, yaml_load))
+    print('%-8s %10s %10s %12s' % ('format', 'dump (s)', 'load (s)', 'size'))
+    with TemporaryDirectory() as directory:
+        for name, dump, load in formats:
+            filename = os.path.join(directory, name)
+            dump_time = timed(dump, db, filename)
+            load_time = timed(load, filename)
+            print(
+                '%-8s %10.3f %10.3f %12d' % (
+                    name, dump_time, load_time, os.path.getsize(filename)
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
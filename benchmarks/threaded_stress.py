@@ -0,0 +1,125 @@
+"""Hammer a thread-safe Database from several threads at once, then check
+that its indices are still consistent.
+
+Usage: python benchmarks/threaded_stress.py [--threads N] [--operations N]
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+from sys import setswitchinterval
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from carehome import Database
+
+parser = ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument(
+    '--threads', type=int, default=8, help='The number of threads to use'
+)
+parser.add_argument(
+    '--operations', type=int, default=20000,
+    help='The number of operations each thread performs'
+)
+parser.add_argument(
+    '--rooms', type=int, default=16, help='The number of rooms to move between'
+)
+parser.add_argument(
+    '--switch-interval', type=float, default=1e-5,
+    help='How often Python switches threads, in seconds'
+)
+
+methods_dir = TemporaryDirectory()
+
+
+def build_world(rooms):
+    """Return (db, base, mixin, rooms)."""
+    db = Database(methods_dir=methods_dir.name, threadsafe=True)
+    base = db.create_object()
+    base.hp = 100
+    base.add_method(
+        'def describe(self):\n    return "%s (%d)" % (self.id, self.hp)'
+    )
+    mixin = db.create_object()
+    mixin.add_method(
+        'def on_enter(self, room, thing):\n    thing.entered = room'
+    )
+    return (db, base, mixin, [db.create_object(base) for x in range(rooms)])
+
+
+def work(db, base, mixin, rooms, operations, seed):
+    """Perform a random mix of reads and changes. Returns the number of
+    operations performed."""
+    random = Random(seed)
+    mine = []
+    for x in range(operations):
+        choice = random.random()
+        if choice < 0.1 or not mine:
+            mine.append(db.create_object(base))
+        elif choice < 0.4:
+            obj = random.choice(mine)
+            obj.describe()
+            obj.hp
+        elif choice < 0.6:
+            random.choice(mine).hp = x
+        elif choice < 0.8:
+            random.choice(mine).location = random.choice(rooms)
+        elif choice < 0.85:
+            obj = random.choice(mine)
+            if mixin in obj.parents:
+                obj.remove_parent(mixin)
+            else:
+                obj.add_parent(mixin)
+        elif choice < 0.9:
+            random.choice(rooms).contents
+        else:
+            obj = mine.pop(random.randrange(len(mine)))
+            obj.location = None
+            db.destroy_object(obj)
+    return operations
+
+
+def check(db):
+    """Raise AssertionError if the indices of db are inconsistent."""
+    for obj in db.objects.values():
+        if obj._location is not None:
+            assert obj.id in db.locations[obj._location], obj
+        for parent in obj._parents:
+            assert any(child is obj for child in parent._children), obj
+        for child in obj._children:
+            assert any(parent is obj for parent in child._parents), obj
+    for location, ids in db.locations.items():
+        for id in ids:
+            assert db.objects[id]._location == location, id
+    assert db.max_id > max(db.objects)
+
+
+def main():
+    args = parser.parse_args()
+    setswitchinterval(args.switch_interval)
+    db, base, mixin, rooms = build_world(args.rooms)
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        total = sum(
+            executor.map(
+                work, *zip(
+                    *[
+                        (db, base, mixin, rooms, args.operations, seed)
+                        for seed in range(args.threads)
+                    ]
+                )
+            )
+        )
+    taken = perf_counter() - started
+    check(db)
+    print(
+        '%d threads performed %d operations in %.2f seconds (%d/s).' % (
+            args.threads, total, taken, total / taken
+        )
+    )
+    print('%d objects remain, and all indices are consistent.' % len(
+        db.objects
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,22 @@
 """The carehome module. Allows you to build MOO-like object-oriented objects in
 Python."""
 
-from .objects import Object
-from .properties import Property
+from .objects import Object, CompactObject
+from .properties import Property, CompactProperty
 from .property_types import property_types
 from .methods import Method
 from .databases import Database, ObjectReference
+from .journals import Journal
+from .bindings import BindingCache
+from .profiling import Profiler
+from .indexes import Index, Range
+from .storage import Storage, SQLiteStorage, SnapshotStorage, ForkStorage
 
 __all__ = ['property_types']
 
 for thing in (
-    Object, Property, Method, Database, ObjectReference
+    Object, Property, Method, Database, ObjectReference, Journal, Storage,
+    SQLiteStorage, SnapshotStorage, Index, Range, BindingCache, CompactObject,
+    CompactProperty, ForkStorage, Profiler
 ):
     __all__.append(thing.__name__)
@@ -0,0 +1,462 @@
+"""Provides the BinaryWriter and BinaryReader classes, which write and read
+binary snapshots of databases.
+
+A snapshot consists of a header, followed by one length-prefixed record per
+object, then a string table, fixed-size sorted tables of object IDs to record
+offsets, parents to children and locations to contents, the registered objects
+and the database's counters, and finally a fixed-size footer giving the
+positions of those sections. Strings (property names, type names,
+descriptions, method code and string values) are stored once in the string
+table and referred to by number, so every record can be decoded on its own,
+and any object can be found without reading the whole file."""
+
+import struct
+from datetime import datetime, timedelta
+from attr import attrs, attrib, Factory
+from .exc import SnapshotError
+from .references import ObjectReference, UnresolvedValue
+
+magic = b'CARE'
+version = 2
+footer = struct.Struct('<QQQQQ4s')
+double = struct.Struct('<d')
+count_struct = struct.Struct('<Q')
+index_entry = struct.Struct('<QQq')
+pair_entry = struct.Struct('<QQ')
+epoch = datetime(1970, 1, 1)
+
+(
+    TAG_NONE, TAG_FALSE, TAG_TRUE, TAG_INT, TAG_FLOAT, TAG_STR, TAG_LIST,
+    TAG_DICT, TAG_REF, TAG_DATETIME, TAG_DURATION, TAG_DATETIME_TZ
+) = range(12)
+
+
+def encode_varint(number, buffer):
+    """Append a non-negative integer number to bytearray buffer."""
+    while number > 0x7f:
+        buffer.append((number & 0x7f) | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+
+def encode_signed(number, buffer):
+    """Append an integer number, which may be negative, to bytearray
+    buffer."""
+    encode_varint(number * 2 if number >= 0 else -number * 2 - 1, buffer)
+
+
+def decode_varint(data, position):
+    """Return a tuple (number, position) read from data at the given
+    position."""
+    number = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (number, position)
+        shift += 7
+
+
+def decode_signed(data, position):
+    """Return a tuple (number, position), where number may be negative."""
+    number, position = decode_varint(data, position)
+    if number & 1:
+        return (-(number + 1) // 2, position)
+    return (number // 2, position)
+
+
+@attrs
+class BinaryWriter:
+    """Writes a database to the binary file-like object fp, one object at a
+    time."""
+
+    database = attrib()
+    fp = attrib()
+    strings = attrib(default=Factory(dict), init=False, repr=False)
+    index = attrib(default=Factory(list), init=False, repr=False)
+    children = attrib(default=Factory(list), init=False, repr=False)
+    contents = attrib(default=Factory(list), init=False, repr=False)
+    position = attrib(default=Factory(int), init=False)
+
+    def write(self, data):
+        """Write data to self.fp, keeping track of the position."""
+        self.fp.write(data)
+        self.position += len(data)
+
+    def string(self, string, buffer):
+        """Append the string table index of string to buffer, adding it to the
+        table if necessary."""
+        index = self.strings.get(string, None)
+        if index is None:
+            index = len(self.strings)
+            self.strings[string] = index
+        encode_varint(index, buffer)
+
+    def value(self, value, buffer):
+        """Append value to buffer."""
+        if value is None:
+            buffer.append(TAG_NONE)
+        elif value is True:
+            buffer.append(TAG_TRUE)
+        elif value is False:
+            buffer.append(TAG_FALSE)
+        elif isinstance(value, int):
+            buffer.append(TAG_INT)
+            encode_signed(value, buffer)
+        elif isinstance(value, float):
+            buffer.append(TAG_FLOAT)
+            buffer.extend(double.pack(value))
+        elif isinstance(value, str):
+            buffer.append(TAG_STR)
+            self.string(value, buffer)
+        elif isinstance(value, (self.database.object_class, ObjectReference)):
+            buffer.append(TAG_REF)
+            encode_varint(value.id, buffer)
+        elif isinstance(value, UnresolvedValue):
+            self.value(value.value, buffer)
+        elif isinstance(value, list):
+            buffer.append(TAG_LIST)
+            encode_varint(len(value), buffer)
+            for entry in value:
+                self.value(entry, buffer)
+        elif isinstance(value, dict):
+            buffer.append(TAG_DICT)
+            encode_varint(len(value), buffer)
+            for key, entry in value.items():
+                self.value(key, buffer)
+                self.value(entry, buffer)
+        elif isinstance(value, datetime):
+            if value.tzinfo is None:
+                buffer.append(TAG_DATETIME)
+                delta = value - epoch
+                encode_signed(delta.days, buffer)
+                encode_varint(delta.seconds, buffer)
+                encode_varint(delta.microseconds, buffer)
+            else:
+                buffer.append(TAG_DATETIME_TZ)
+                self.string(value.isoformat(), buffer)
+        elif isinstance(value, timedelta):
+            buffer.append(TAG_DURATION)
+            encode_signed(value.days, buffer)
+            encode_varint(value.seconds, buffer)
+            encode_varint(value.microseconds, buffer)
+        else:
+            raise SnapshotError('Cannot encode value: %r.' % value)
+
+    def write_object(self, obj):
+        """Write a record for Object instance obj."""
+        database = self.database
+        buffer = bytearray()
+        encode_varint(obj.id, buffer)
+        if obj._location is None:
+            encode_varint(0, buffer)
+        else:
+            encode_varint(obj._location + 1, buffer)
+            self.contents.append((obj._location, obj.id))
+        encode_varint(len(obj._parents), buffer)
+        for parent in obj._parents:
+            encode_varint(parent.id, buffer)
+            self.children.append((parent.id, obj.id))
+        properties = [
+            p for p in obj._properties.values()
+            if isinstance(p, database.property_class)
+        ]
+        encode_varint(len(properties), buffer)
+        for p in properties:
+            self.string(p.name, buffer)
+            self.string(database.property_type_name(p), buffer)
+            self.value(p.description, buffer)
+            self.value(p.value, buffer)
+        encode_varint(len(obj._methods), buffer)
+        for m in obj._methods.values():
+            self.string(m.name, buffer)
+            self.string(m.code, buffer)
+        location = -1 if obj._location is None else obj._location
+        self.index.append((obj.id, self.position, location))
+        length = bytearray()
+        encode_varint(len(buffer), length)
+        self.write(bytes(length))
+        self.write(bytes(buffer))
+
+    def write_table(self, entry, entries):
+        """Write a count, followed by all the entries packed with the
+        struct.Struct instance entry. Returns the position of the table."""
+        position = self.position
+        table = bytearray(count_struct.pack(len(entries)))
+        for values in entries:
+            table.extend(entry.pack(*values))
+        self.write(bytes(table))
+        return position
+
+    def write_database(self):
+        """Write the whole database."""
+        database = self.database
+        self.write(magic + bytes([version]))
+        for id in sorted(database.objects):
+            self.write_object(database.objects[id])
+        meta = bytearray()
+        encode_varint(len(database.registered_objects), meta)
+        for name, obj in database.registered_objects.items():
+            self.string(name, meta)
+            encode_varint(obj.id, meta)
+        encode_varint(database.max_id, meta)
+        encode_varint(database.journal_sequence, meta)
+        offsets = []
+        for string in self.strings:
+            data = string.encode()
+            buffer = bytearray()
+            encode_varint(len(data), buffer)
+            offsets.append((self.position,))
+            self.write(bytes(buffer) + data)
+        strings_offset = self.write_table(count_struct, offsets)
+        index_offset = self.write_table(index_entry, self.index)
+        children_offset = self.write_table(pair_entry, sorted(self.children))
+        contents_offset = self.write_table(pair_entry, sorted(self.contents))
+        meta_offset = self.position
+        self.write(bytes(meta))
+        self.write(
+            footer.pack(
+                strings_offset, index_offset, children_offset,
+                contents_offset, meta_offset, magic
+            )
+        )
+
+
+@attrs
+class BinaryReader:
+    """Reads a binary snapshot from data, which can be any bytes-like object,
+    including an mmap. Only the footer and the registered objects are read
+    up front; everything else is read when it is asked for. Values are
+    returned with ObjectReference instances in place of objects, as with
+    Database.dump_value."""
+
+    database = attrib()
+    data = attrib()
+    strings = attrib(default=Factory(dict), init=False, repr=False)
+    registered_objects = attrib(default=Factory(dict), init=False, repr=False)
+    max_id = attrib(default=Factory(int), init=False)
+    journal_sequence = attrib(default=Factory(int), init=False)
+    strings_offset = attrib(default=Factory(int), init=False, repr=False)
+    index_offset = attrib(default=Factory(int), init=False, repr=False)
+    children_offset = attrib(default=Factory(int), init=False, repr=False)
+    contents_offset = attrib(default=Factory(int), init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        data = self.data
+        if len(data) < footer.size + 5 or data[:4] != magic:
+            raise SnapshotError('Not a snapshot.')
+        if data[4] != version:
+            raise SnapshotError('Unsupported snapshot version %d.' % data[4])
+        (
+            self.strings_offset, self.index_offset, self.children_offset,
+            self.contents_offset, meta_offset, end
+        ) = footer.unpack_from(data, len(data) - footer.size)
+        if end != magic:
+            raise SnapshotError('Snapshot is truncated.')
+        count, position = decode_varint(data, meta_offset)
+        for x in range(count):
+            name, position = self.string(position)
+            id, position = decode_varint(data, position)
+            self.registered_objects[name] = id
+        self.max_id, position = decode_varint(data, position)
+        self.journal_sequence, position = decode_varint(data, position)
+
+    def get_string(self, index):
+        """Return the string with the given index in the string table."""
+        string = self.strings.get(index, None)
+        if string is None:
+            offset = count_struct.unpack_from(
+                self.data,
+                self.strings_offset + count_struct.size * (index + 1)
+            )[0]
+            length, offset = decode_varint(self.data, offset)
+            string = bytes(self.data[offset:offset + length]).decode()
+            self.strings[index] = string
+        return string
+
+    def string(self, position):
+        """Return a tuple (string, position)."""
+        index, position = decode_varint(self.data, position)
+        return (self.get_string(index), position)
+
+    def table(self, offset):
+        """Return a tuple (count, start) for the table at the given offset,
+        where start is the position of the first entry."""
+        return (
+            count_struct.unpack_from(self.data, offset)[0],
+            offset + count_struct.size
+        )
+
+    def search(self, offset, entry, key):
+        """Return the entries from the table at the given offset whose first
+        value is key. Tables are sorted, so this is a binary search."""
+        count, start = self.table(offset)
+        low = 0
+        high = count
+        while low < high:
+            middle = (low + high) // 2
+            value = entry.unpack_from(
+                self.data, start + middle * entry.size
+            )[0]
+            if value < key:
+                low = middle + 1
+            else:
+                high = middle
+        results = []
+        while low < count:
+            values = entry.unpack_from(self.data, start + low * entry.size)
+            if values[0] != key:
+                break
+            results.append(values)
+            low += 1
+        return results
+
+    def lookup(self, id):
+        """Return a tuple (offset, location) for the object with the given
+        ID, or None if there is no such object."""
+        for id, offset, location in self.search(
+            self.index_offset, index_entry, id
+        ):
+            return (offset, None if location < 0 else location)
+
+    def ids(self):
+        """Yield the IDs of all objects, in order."""
+        count, start = self.table(self.index_offset)
+        for x in range(count):
+            yield index_entry.unpack_from(
+                self.data, start + x * index_entry.size
+            )[0]
+
+    def count(self):
+        """Return the number of objects."""
+        return self.table(self.index_offset)[0]
+
+    def children_of(self, id):
+        """Return the IDs of the children of the object with the given ID."""
+        return [
+            child for parent, child in
+            self.search(self.children_offset, pair_entry, id)
+        ]
+
+    def contents_of(self, id):
+        """Return the IDs of the objects whose location is the object with the
+        given ID."""
+        return [
+            thing for location, thing in
+            self.search(self.contents_offset, pair_entry, id)
+        ]
+
+    def locations(self):
+        """Yield the IDs of every object which has contents."""
+        count, start = self.table(self.contents_offset)
+        last = None
+        for x in range(count):
+            location = pair_entry.unpack_from(
+                self.data, start + x * pair_entry.size
+            )[0]
+            if location != last:
+                yield location
+                last = location
+
+    def value(self, position, ids=None):
+        """Return a tuple (value, position). If ids is a set, the IDs of any
+        referenced objects will be added to it."""
+        data = self.data
+        tag = data[position]
+        position += 1
+        if tag == TAG_NONE:
+            return (None, position)
+        elif tag == TAG_TRUE:
+            return (True, position)
+        elif tag == TAG_FALSE:
+            return (False, position)
+        elif tag == TAG_INT:
+            return decode_signed(data, position)
+        elif tag == TAG_FLOAT:
+            return (
+                double.unpack_from(data, position)[0], position + double.size
+            )
+        elif tag == TAG_STR:
+            return self.string(position)
+        elif tag == TAG_REF:
+            id, position = decode_varint(data, position)
+            if ids is not None:
+                ids.add(id)
+            return (ObjectReference(id), position)
+        elif tag == TAG_LIST:
+            count, position = decode_varint(data, position)
+            value = []
+            for x in range(count):
+                entry, position = self.value(position, ids)
+                value.append(entry)
+            return (value, position)
+        elif tag == TAG_DICT:
+            count, position = decode_varint(data, position)
+            value = {}
+            for x in range(count):
+                key, position = self.value(position, ids)
+                value[key], position = self.value(position, ids)
+            return (value, position)
+        elif tag in (TAG_DATETIME, TAG_DURATION):
+            days, position = decode_signed(data, position)
+            seconds, position = decode_varint(data, position)
+            microseconds, position = decode_varint(data, position)
+            value = timedelta(days, seconds, microseconds)
+            if tag == TAG_DATETIME:
+                value = epoch + value
+            return (value, position)
+        elif tag == TAG_DATETIME_TZ:
+            string, position = self.string(position)
+            return (datetime.fromisoformat(string), position)
+        raise SnapshotError('Invalid tag %d at %d.' % (tag, position - 1))
+
+    def read_object(self, offset):
+        """Return a tuple (d, needed), where d is a dictionary as returned by
+        Database.dump_object for the record at the given offset, and needed is
+        the set of IDs of all the objects it refers to."""
+        data = self.data
+        length, position = decode_varint(data, offset)
+        id, position = decode_varint(data, position)
+        location, position = decode_varint(data, position)
+        count, position = decode_varint(data, position)
+        parents = []
+        for x in range(count):
+            parent, position = decode_varint(data, position)
+            parents.append(parent)
+        needed = set(parents)
+        count, position = decode_varint(data, position)
+        properties = []
+        for x in range(count):
+            name, position = self.string(position)
+            type, position = self.string(position)
+            description, position = self.value(position)
+            value, position = self.value(position, needed)
+            properties.append(
+                dict(
+                    name=name, type=type, description=description,
+                    value=value
+                )
+            )
+        count, position = decode_varint(data, position)
+        methods = []
+        for x in range(count):
+            name, position = self.string(position)
+            code, position = self.string(position)
+            methods.append(dict(name=name, code=code))
+        d = dict(
+            id=id, location=None if location == 0 else location - 1,
+            parents=parents, properties=properties, methods=methods
+        )
+        return (d, needed)
+
+    def read_objects(self):
+        """Yield a tuple (d, needed) for every object, as per
+        self.read_object."""
+        count, start = self.table(self.index_offset)
+        for x in range(count):
+            id, offset, location = index_entry.unpack_from(
+                self.data, start + x * index_entry.size
+            )
+            yield self.read_object(offset)
@@ -0,0 +1,79 @@
+"""Provides the BindingCache class."""
+
+from collections import OrderedDict
+from contextlib import nullcontext
+from types import MethodType
+from attr import attrs, attrib, Factory
+
+
+@attrs
+class BindingCache:
+    """A least-recently-used cache of methods bound to objects, shared by
+    every object in a database. Entries are keyed by (object ID, method name),
+    and are only used while they still refer to the same object and the same
+    function, so a replaced method or a reloaded object is never served
+    stale. No more than size bindings are kept. Changes are made while
+    holding lock, which a thread-safe Database replaces with a real lock. If
+    profiler is not None, new bindings are wrapped by profiler.wrap."""
+
+    size = attrib(default=Factory(lambda: 10000))
+    lock = attrib(default=Factory(nullcontext), repr=False, eq=False)
+    profiler = attrib(default=Factory(type(None)), init=False, repr=False)
+    entries = attrib(default=Factory(OrderedDict), init=False, repr=False)
+    names = attrib(default=Factory(dict), init=False, repr=False)
+    hits = attrib(default=Factory(int), init=False)
+    misses = attrib(default=Factory(int), init=False)
+    evictions = attrib(default=Factory(int), init=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, obj, name, method, owner=None):
+        """Return Method instance method, which was found under the given name
+        on Object instance owner (obj if owner is None), bound to Object
+        instance obj."""
+        with self.lock:
+            key = (obj.id, name)
+            bound = self.entries.get(key, None)
+            if (
+                bound is not None and bound.__func__ is method.func and
+                bound.__self__ is obj
+            ):
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return bound
+            self.misses += 1
+            bound = MethodType(method.func, obj)
+            if self.profiler is not None:
+                bound = self.profiler.wrap(
+                    bound, obj if owner is None else owner, name
+                )
+            self.entries[key] = bound
+            self.entries.move_to_end(key)
+            self.names.setdefault(obj.id, set()).add(name)
+            while len(self.entries) > self.size:
+                (id, name), value = self.entries.popitem(last=False)
+                self.forget_name(id, name)
+                self.evictions += 1
+            return bound
+
+    def forget_name(self, id, name):
+        """Remove name from the set of cached names for the object with the
+        given ID."""
+        names = self.names.get(id, None)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self.names[id]
+
+    def discard(self, id):
+        """Forget every binding for the object with the given ID."""
+        with self.lock:
+            for name in self.names.pop(id, ()):
+                del self.entries[(id, name)]
+
+    def clear(self):
+        """Forget every binding. Statistics are kept."""
+        with self.lock:
+            self.entries.clear()
+            self.names.clear()
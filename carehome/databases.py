@@ -2,22 +2,33 @@
 
 import os
 import os.path
+import json
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from threading import RLock
 from attr import attrs, attrib, Factory
 from .exc import (
     LoadPropertyError, LoadMethodError, LoadObjectError, ObjectRegisteredError,
-    HasChildrenError, HasContentsError, IsValueError
+    HasChildrenError, HasContentsError, IsValueError, ReadOnlyError
 )
 from .objects import Object
 from .properties import Property
-from .methods import Method
-from .property_types import property_types
-
-
-@attrs
-class ObjectReference:
-    """A reference to an object. used when dumping and loading properties."""
-
-    id = attrib()
+from .methods import Method, validate_source
+from .journals import Journal
+from .bindings import BindingCache
+from .locks import LockStripes
+from .profiling import Profiler
+from .references import ObjectReference, UnresolvedValue
+from .binary import BinaryWriter, BinaryReader
+from .indexes import Index, Range
+from .storage import ForkStorage
+from .property_types import property_types, PropertyTypes
+from .transactions import (
+    restore_object, forget_object, restore_registration
+)
 
 
 @attrs
@@ -28,29 +39,91 @@ class Database:
     objects = attrib(default=Factory(dict), init=False, repr=False)
     max_id = attrib(default=Factory(int), init=False)
     registered_objects = attrib(default=Factory(dict), init=False, repr=False)
+    locations = attrib(default=Factory(dict), init=False, repr=False)
+    references = attrib(default=Factory(dict), init=False, repr=False)
+    containers = attrib(default=Factory(set), init=False, repr=False)
+    dirty = attrib(default=Factory(set), init=False, repr=False)
+    indexes = attrib(default=Factory(dict), init=False, repr=False)
+    event_counts = attrib(default=Factory(Counter), init=False, repr=False)
+    event_misses = attrib(default=Factory(Counter), init=False, repr=False)
+    event_queue = attrib(default=Factory(type(None)), init=False, repr=False)
+    destroyed = attrib(default=Factory(dict), init=False, repr=False)
+    destroying = attrib(default=Factory(set), init=False, repr=False)
     object_class = attrib(default=Factory(lambda: Object))
     property_class = attrib(default=Factory(lambda: Property))
     method_class = attrib(default=Factory(lambda: Method))
     property_types = attrib(default=Factory(lambda: property_types.copy()))
     method_globals = attrib(default=Factory(type(None)))
     methods_dir = attrib(default=Factory(lambda: 'methods'))
+    bytecode_cache = attrib(default=Factory(bool))
+    journal = attrib(default=Factory(type(None)))
+    storage = attrib(default=Factory(type(None)))
+    journal_sequence = attrib(default=Factory(int), init=False)
+    replaying = attrib(default=Factory(bool), init=False, repr=False)
+    code_cache = attrib(default=Factory(dict), init=False, repr=False)
+    bindings = attrib(default=Factory(BindingCache), repr=False)
+    threadsafe = attrib(default=Factory(bool))
+    lock = attrib(default=Factory(nullcontext), init=False, repr=False)
+    stripes = attrib(default=Factory(type(None)), init=False, repr=False)
+    undo_logs = attrib(
+        default=Factory(lambda: ContextVar('undo_log', default=None)),
+        init=False, repr=False
+    )
+    rollbacks = attrib(
+        default=Factory(lambda: ContextVar('rolling_back', default=False)),
+        init=False, repr=False
+    )
+    deltas = attrib(
+        default=Factory(lambda: ContextVar('applying_delta', default=False)),
+        init=False, repr=False
+    )
+    profiler = attrib(default=Factory(type(None)), init=False, repr=False)
+    read_only = attrib(default=Factory(bool), init=False, repr=False)
 
     def __attrs_post_init__(self):
         if not os.path.isdir(self.methods_dir):
             os.makedirs(self.methods_dir)
+        if self.storage is not None:
+            self.objects = self.storage
+        if self.threadsafe:
+            self.lock = RLock()
+            self.stripes = LockStripes()
+            self.bindings.lock = RLock()
         if self.method_globals is None:
             self.method_globals = dict(database=self)
         self.method_globals.setdefault('objects', self.objects)
+        if not isinstance(self.property_types, PropertyTypes):
+            self.property_types = PropertyTypes(self.property_types)
         self.property_types['obj'] = self.object_class
+        if self.storage is not None:
+            self.storage.bind(self)
+
+    def check_writable(self):
+        """Raise ReadOnlyError if this database cannot be changed. Called
+        before anything is changed, so a failed change leaves no trace."""
+        if self.read_only:
+            raise ReadOnlyError(self)
 
     def new_id(self):
         """Get a unique ID and increment self.max_id."""
-        self.max_id += 1
-        return self.max_id - 1
+        with self.lock:
+            self.max_id += 1
+            return self.max_id - 1
+
+    def locked(self, *ids):
+        """Return a context manager which holds the locks for the objects with
+        the given IDs if self.threadsafe is True, and does nothing otherwise.
+        Locks are taken for structural changes, after any events have been
+        fired, and never while self.lock is held, so they cannot deadlock.
+        Reads do not take locks."""
+        if self.stripes is None:
+            return nullcontext()
+        return self.stripes.hold(*ids)
 
     def create_object(self, *parents):
         """Create an object that will be added to the dictionary of objects.
         This object will have all the provided parents added to it."""
+        self.check_writable()
         o = self.object_class(self, id=self.new_id())
         for parent in parents:
             o.add_parent(parent)
@@ -58,12 +131,50 @@ class Database:
         o.try_event('on_init', o)
         return o
 
+    async def acreate_object(self, *parents):
+        """Like create_object, but awaits the on_add_parent, on_add_child,
+        on_attach and on_init events, so they can be coroutine functions."""
+        self.check_writable()
+        o = self.object_class(self, id=self.new_id())
+        for parent in parents:
+            await o.aadd_parent(parent)
+        await self.aattach_object(o)
+        await o.atry_event('on_init', o)
+        return o
+
     def attach_object(self, o):
         """Attach an Object instance o to this database."""
-        self.max_id = max(o.id + 1, self.max_id)
-        self.objects[o.id] = o
+        self.store_object(o)
         o.try_event('on_attach', o)
 
+    async def aattach_object(self, o):
+        """Like attach_object, but awaits the on_attach event."""
+        self.store_object(o)
+        await o.atry_event('on_attach', o)
+
+    def store_object(self, o):
+        """Add an Object instance o to this database without firing any
+        events."""
+        self.check_writable()
+        with self.lock:
+            self.max_id = max(o.id + 1, self.max_id)
+            if self.objects.get(o.id) is not o:
+                self.write_journal(
+                    'attach', id=o.id, location=o._location,
+                    parents=[parent.id for parent in o._parents]
+                )
+                attached = True
+            else:
+                attached = False
+            self.objects[o.id] = o
+            self.mark_dirty(o)
+            self.update_location_index(o, None, o._location)
+            for name, prop in o._properties.items():
+                if isinstance(prop, self.property_class):
+                    self.update_references(o, name, None, prop.value)
+            if attached:
+                self.record_undo(o, forget_object, o)
+
     def test_value(self, value, obj):
         """Return True if obj is found somewhere in value."""
         if value is obj:
@@ -85,27 +196,652 @@ class Database:
 
     def destroy_object(self, obj):
         """Destroy an object obj."""
+        self.check_writable()
+        self.check_destroy(obj)
+        obj.try_event('on_destroy', obj)
+        self.remove_object(obj)
+
+    async def adestroy_object(self, obj):
+        """Like destroy_object, but awaits the on_destroy, on_remove_parent
+        and on_remove_child events."""
+        self.check_writable()
+        self.check_destroy(obj)
+        await obj.atry_event('on_destroy', obj)
+        await self.aremove_object(obj)
+
+    def check_destroy(self, obj):
+        """Raise an error if Object instance obj cannot be destroyed."""
         for name, value in self.registered_objects.items():
             if value is obj:
                 raise ObjectRegisteredError(name, value)
         if obj.children:
             raise HasChildrenError(obj)
-        if obj.contents:
+        if obj.has_contents:
             raise HasContentsError(obj)
-        obj.try_event('on_destroy', obj)
-        for thing in self.objects.values():
-            for prop in thing._properties.values():
-                if self.test_value(prop.value, obj):
-                    raise IsValueError(thing, prop)
-        for parent in obj._parents:
-            obj.remove_parent(parent)
-        del self.objects[obj.id]
+
+    def remove_object(self, obj):
+        """Remove Object instance obj from this database, without firing any
+        events. Raises IsValueError if obj is still referenced. If
+        self.threadsafe is True, the checks made by check_destroy are
+        repeated while holding the lock for obj. Until obj is gone, its ID
+        is in self.destroying, so nothing can be moved into it or given it
+        as a parent."""
+        self.start_removal(obj)
+        try:
+            for parent in obj.parents:
+                obj.remove_parent(parent)
+            self.finish_removal(obj)
+        finally:
+            self.destroying.discard(obj.id)
+
+    async def aremove_object(self, obj):
+        """Like remove_object, but awaits the on_remove_parent and
+        on_remove_child events."""
+        self.start_removal(obj)
+        try:
+            for parent in obj.parents:
+                await obj.aremove_parent(parent)
+            self.finish_removal(obj)
+        finally:
+            self.destroying.discard(obj.id)
+
+    def start_removal(self, obj):
+        """Check that Object instance obj can be removed, and add its ID to
+        self.destroying."""
+        self.check_writable()
+        with self.locked(obj.id), self.lock:
+            if self.threadsafe:
+                self.check_destroy(obj)
+            for thing, prop in self.referrers(obj):
+                raise IsValueError(thing, prop)
+            self.destroying.add(obj.id)
+
+    def finish_removal(self, obj):
+        """Remove Object instance obj, which no longer has any parents, from
+        this database."""
+        self.record_undo(obj, restore_object, obj)
+        with self.locked(obj.id, obj._location), self.lock:
+            for name, prop in obj._properties.items():
+                self.update_references(obj, name, prop.value, None)
+            self.references.pop(obj.id, None)
+            self.update_location_index(obj, obj._location, None)
+            self.locations.pop(obj.id, None)
+            del self.objects[obj.id]
+            self.dirty.discard(obj.id)
+            self.destroyed[obj.id] = None
+            for index in self.indexes.values():
+                index.discard(obj.id)
+            self.write_journal('destroy', id=obj.id)
+
+    def mark_dirty(self, obj, op=None, **kwargs):
+        """Note that Object instance obj has changed since the last
+        checkpoint. If op is not None, the change is also written to the
+        journal, with the given keyword arguments."""
+        with self.lock:
+            if self.objects.get(obj.id) is obj:
+                self.dirty.add(obj.id)
+                if self.storage is not None:
+                    self.storage.touch(obj)
+                if self.indexes:
+                    if op in ('set', 'add_property', 'remove_property'):
+                        if kwargs['name'] in self.indexes:
+                            self.update_indexes(obj, kwargs['name'])
+                    elif op in (None, 'add_parent', 'remove_parent'):
+                        self.update_indexes(obj)
+                if op is not None:
+                    self.write_journal(op, id=obj.id, **kwargs)
+
+    def write_journal(self, op, **kwargs):
+        """Write a record of the operation op to self.journal, if there is
+        one. Values and property types are converted so the record can be
+        serialised as JSON."""
+        with self.lock:
+            if self.journal is None or self.replaying:
+                return
+            if 'value' in kwargs:
+                kwargs['value'] = self.encode_json_value(
+                    self.dump_value(kwargs['value'])
+                )
+            if 'type' in kwargs:
+                kwargs['type'] = self.property_types.name_of(kwargs['type'])
+            self.journal_sequence += 1
+            self.journal.write(
+                dict(op=op, seq=self.journal_sequence, **kwargs)
+            )
+
+    def replay(self, records):
+        """Apply an iterable of journal records to this database. Records
+        which are already reflected by this database (because they were
+        written before the snapshot it was loaded from) are skipped. No events
+        are run."""
+        self.replaying = True
+        try:
+            for record in records:
+                if record['seq'] <= self.journal_sequence:
+                    continue
+                self.replay_record(record)
+                self.journal_sequence = record['seq']
+        finally:
+            self.replaying = False
+
+    def replay_record(self, record):
+        """Apply a single journal record to this database."""
+        op = record['op']
+        if op == 'register':
+            return self.register_object(
+                record['name'], self.objects[record['id']]
+            )
+        elif op == 'unregister':
+            return self.unregister_object(record['name'])
+        elif op == 'attach':
+            o = self.object_class(self, id=record['id'])
+            o._location = record['location']
+            for id in record['parents']:
+                o.add_parent(self.objects[id])
+            return self.attach_object(o)
+        obj = self.objects[record['id']]
+        if op == 'destroy':
+            self.destroy_object(obj)
+        elif op == 'set':
+            obj._properties[record['name']].value = self.load_value(
+                self.decode_json_value(record['value'])
+            )
+        elif op == 'add_property':
+            obj.add_property(
+                record['name'], self.property_types[record['type']],
+                self.load_value(self.decode_json_value(record['value'])),
+                description=record['description']
+            )
+        elif op == 'remove_property':
+            obj.remove_property(record['name'])
+        elif op == 'add_parent':
+            obj.add_parent(
+                self.objects[record['parent']], index=record.get('index', None)
+            )
+        elif op == 'remove_parent':
+            obj.remove_parent(self.objects[record['parent']])
+        elif op == 'add_method':
+            obj.add_method(record['code'], name=record['name'])
+        elif op == 'remove_method':
+            obj.remove_method(record['name'])
+        elif op == 'move':
+            location = record['location']
+            if location is not None:
+                location = self.objects[location]
+            obj.location = location
+        else:
+            raise ValueError('Invalid journal record: %r.' % record)
+
+    def recover(self, snapshot_filename, journal_filename):
+        """Load the snapshot with the given filename (if it exists), replay
+        the journal with the given filename, then append further changes to
+        that journal."""
+        if os.path.isfile(snapshot_filename):
+            with open(snapshot_filename, 'r') as f:
+                self.load_stream(f)
+        self.replay(Journal.read(journal_filename))
+        self.checkpoint()
+        self.journal = Journal(journal_filename)
+
+    def compact(self, snapshot_filename):
+        """Write this database to the snapshot with the given filename, then
+        empty the journal. The snapshot remembers the last journal record it
+        contains, so if we crash before the journal is emptied, replaying it
+        is still safe."""
+        filename = snapshot_filename + '.tmp'
+        with open(filename, 'w') as f:
+            self.dump_stream(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(filename, snapshot_filename)
+        if self.journal is not None:
+            self.journal.truncate()
+
+    def checkpoint(self):
+        """Forget all changes, so that the next delta is relative to the
+        current state of this database."""
+        self.dirty.clear()
+        self.destroyed.clear()
+
+    def dump_delta(self, checkpoint=True):
+        """Return a dictionary of all the objects which have been created or
+        changed, and the IDs of all the objects which have been destroyed,
+        since the last checkpoint. Unless checkpoint is False, a new
+        checkpoint is then made. Lists and dictionaries can be changed in
+        place without anything noticing, so every object with one as a
+        property value is included."""
+        self.mark_containers_dirty()
+        d = dict(
+            max_id=self.max_id, objects=[
+                self.dump_object(self.objects[id]) for id in sorted(self.dirty)
+            ], destroyed=list(self.destroyed), registered_objects={
+                name: obj.id for name, obj in self.registered_objects.items()
+            }
+        )
+        if checkpoint:
+            self.checkpoint()
+        return d
+
+    def update_object(self, obj, d):
+        """Replace the location, methods, properties and parents of Object
+        instance obj with those from a dictionary d. Only the things which
+        differ are changed, and properties whose types have not changed keep
+        their Property instances."""
+        location = d.get('location', None)
+        if location != obj._location:
+            self.update_location_index(obj, obj._location, location)
+            object.__setattr__(obj, '_location', location)
+            self.mark_dirty(obj, 'move', location=location)
+        methods = {data['name']: data for data in d.get('methods', [])}
+        for name in list(obj._methods):
+            if name not in methods:
+                obj.remove_method(name)
+        for name, data in methods.items():
+            m = obj._methods.get(name, None)
+            if m is None or m.code != data['code']:
+                self.load_method(obj, data)
+        properties = {data['name']: data for data in d['properties']}
+        for name in list(obj._properties):
+            if name not in properties:
+                obj.remove_property(name)
+        for name, data in properties.items():
+            p = obj._properties.get(name, None)
+            if p is None or p.type is not self.property_types.get(
+                data['type']
+            ):
+                if p is not None:
+                    obj.remove_property(name)
+                self.load_property(obj, data)
+                continue
+            value = data.get('value', None)
+            if self.dump_value(p.value) != value:
+                p.value = self.load_value(value)
+            description = data.get('description', None)
+            if p.description != description:
+                p.description = description
+                self.mark_dirty(obj)
+        if [parent.id for parent in obj._parents] != d['parents']:
+            for parent in obj.parents:
+                obj.remove_parent(parent)
+            for id in d['parents']:
+                obj.add_parent(self.objects[id])
+
+    def apply_delta(self, d, checkpoint=True):
+        """Apply a dictionary d, as returned by self.dump_delta, to this
+        database. Unless checkpoint is False, a new checkpoint is then made,
+        so the changes are not included in the next delta. No events are run,
+        as with self.replay."""
+        token = self.deltas.set(True)
+        try:
+            self.apply_changes(d)
+        finally:
+            self.deltas.reset(token)
+        if checkpoint:
+            self.checkpoint()
+
+    def apply_changes(self, d):
+        """Do the work of self.apply_delta."""
+        new_ids = set()
+        for data in d['objects']:
+            if data['id'] not in self.objects:
+                self.load_object(data)
+                new_ids.add(data['id'])
+        for data in d['objects']:
+            obj = self.objects[data['id']]
+            if obj.id in new_ids:
+                self.finish_loading_object(obj, data)
+            else:
+                self.update_object(obj, data)
+        self.registered_objects.clear()
+        for name, id in d['registered_objects'].items():
+            self.register_object(name, self.objects[id])
+        for id in d['destroyed']:
+            if id in self.objects:
+                self.destroy_object(self.objects[id])
+        self.max_id = max(self.max_id, d['max_id'])
+
+    def fork(self, cache_size=10000):
+        """Return a new Database whose objects are read through from this one
+        and copied when they are first accessed, using a ForkStorage
+        instance. Changes to the fork never change this database, so it can
+        simply be thrown away, or its changes can be applied to this
+        database with self.merge. Compiled method code is shared, so no
+        methods are compiled or written again."""
+        return type(self)(
+            storage=ForkStorage(self, cache_size=cache_size),
+            object_class=self.object_class,
+            property_class=self.property_class, method_class=self.method_class,
+            property_types=self.property_types.copy(),
+            method_globals=dict(self.method_globals),
+            methods_dir=self.methods_dir, bytecode_cache=self.bytecode_cache,
+            threadsafe=self.threadsafe
+        )
+
+    def merge(self, fork):
+        """Apply the changes made to fork, as returned by self.fork, since it
+        was created or last merged. The changes are included in the next
+        delta of this database, along with its own."""
+        self.apply_delta(fork.dump_delta(), checkpoint=False)
+
+    @property
+    def undo_log(self):
+        """The list of changes made by the transaction which is running in the
+        current thread or asyncio task, or None if there is no transaction.
+        """
+        return self.undo_logs.get()
+
+    @property
+    def applying_delta(self):
+        """True while the current thread or asyncio task is applying a delta
+        with self.apply_delta."""
+        return self.deltas.get()
+
+    @property
+    def suppressing_events(self):
+        """True if no events should be run, because this database is replaying
+        its journal, or the current thread or asyncio task is rolling back a
+        transaction or applying a delta."""
+        return self.replaying or self.rollbacks.get() or self.deltas.get()
+
+    @property
+    def rolling_back(self):
+        """True while the current thread or asyncio task is rolling back a
+        transaction."""
+        return self.rollbacks.get()
+
+    @contextmanager
+    def transaction(self):
+        """A context manager which undoes every change made to this database
+        inside it if an exception is raised, then re-raises the exception.
+        Transactions can be nested, in which case an exception only undoes
+        the changes made since the innermost transaction began. Changes are
+        recorded in self.undo_log, which is discarded when the outermost
+        transaction ends. Rolling back fires no events, but is written to
+        the journal like any other change. Each thread and asyncio task has
+        its own transactions, and only its own changes are recorded."""
+        log = self.undo_log
+        outermost = log is None
+        if outermost:
+            log = []
+            token = self.undo_logs.set(log)
+        savepoint = len(log)
+        try:
+            yield
+        except BaseException:
+            self.rollback(savepoint)
+            raise
+        finally:
+            if outermost:
+                self.undo_logs.reset(token)
+
+    def record_undo(self, obj, func, *args):
+        """If a transaction is in progress, note that func should be called
+        with args to undo a change to Object instance obj. Changes to objects
+        which are not in this database are ignored. If obj is None, the
+        change is always recorded."""
+        log = self.undo_log
+        if log is not None and (
+            obj is None or self.objects.get(obj.id) is obj
+        ):
+            log.append((func, args))
+
+    def rollback(self, savepoint=0):
+        """Undo the changes recorded in self.undo_log after the first savepoint
+        entries, most recent first."""
+        log = self.undo_log
+        token = self.undo_logs.set(None)
+        rolling_back = self.rollbacks.set(True)
+        try:
+            while len(log) > savepoint:
+                func, args = log.pop()
+                func(*args)
+        finally:
+            self.rollbacks.reset(rolling_back)
+            self.undo_logs.reset(token)
+
+    @contextmanager
+    def batch_events(self):
+        """A context manager which queues the events fired by Object.try_event
+        and delivers them when the outermost batch ends, in the order they
+        were fired. An event which is identical to the one queued just before
+        it (the same object, name and arguments) is not delivered again, but
+        events separated by others are all delivered, since they may no
+        longer have the same effect. If a handler has a true batched
+        attribute, it is called once per object with a list of (args, kwargs)
+        tuples instead (outside of a batch, such handlers receive a list of
+        one)."""
+        outermost = self.event_queue is None
+        if outermost:
+            self.event_queue = []
+        try:
+            yield
+        finally:
+            if outermost:
+                queue = self.event_queue
+                self.event_queue = None
+                self.deliver_events(queue)
+
+    def deliver_events(self, queue):
+        """Deliver a list of (obj, name, args, kwargs) tuples, as queued by
+        self.batch_events."""
+        previous = None
+        batches = {}
+        calls = []
+        for obj, name, args, kwargs in queue:
+            key = (
+                id(obj), name, tuple(id(arg) for arg in args),
+                tuple(sorted((x, id(y)) for x, y in kwargs.items()))
+            )
+            if key == previous:
+                continue
+            previous = key
+            handler = obj.get_handler(name)
+            if handler is None:
+                self.event_misses[name] += 1
+            elif getattr(handler, 'batched', False):
+                events = batches.get((id(obj), name), None)
+                if events is None:
+                    events = []
+                    batches[(id(obj), name)] = events
+                    calls.append((name, handler, (events,), {}))
+                events.append((args, kwargs))
+            else:
+                calls.append((name, handler, args, kwargs))
+        for name, handler, args, kwargs in calls:
+            self.event_counts[name] += 1
+            handler(*args, **kwargs)
+
+    def add_index(self, name, sorted=False):
+        """Index the values of the property with the given name, including
+        inherited values, so that Database.query can find them quickly. If
+        sorted is True, the index can be used for ranges as well as equality.
+        Returns the new Index instance."""
+        index = Index(name, sorted=sorted)
+        for obj in self.objects.values():
+            index.update(obj)
+        self.indexes[name] = index
+        return index
+
+    def remove_index(self, name):
+        """Remove the index with the given name."""
+        del self.indexes[name]
+
+    def update_indexes(self, obj, name=None):
+        """Update the index with the given name (or all indexes if name is
+        None) for Object instance obj and all of its descendants, since they
+        may inherit its values."""
+        if name is None:
+            indexes = list(self.indexes.values())
+        else:
+            indexes = [self.indexes[name]]
+        objects = [obj]
+        objects.extend(obj.descendants())
+        for thing in objects:
+            for index in indexes:
+                index.update(thing)
+
+    def query(self, isa=None, location=None, **conditions):
+        """Return a list of objects, ordered by ID, whose properties match the
+        given conditions. Each condition maps a property name to either a
+        value which must be equal, or a Range instance. Inherited values
+        count. If isa is given, only descendants of that object are
+        returned. If location is given, only objects in that location are
+        returned. Indexes are used where possible, and remaining conditions
+        are checked one object at a time."""
+        candidates = []
+        unchecked = {}
+        for name, condition in conditions.items():
+            ids = None
+            index = self.indexes.get(name, None)
+            if index is not None:
+                if isinstance(condition, Range):
+                    ids = index.range(condition)
+                else:
+                    ids = index.equal(condition)
+            if ids is None:
+                unchecked[name] = condition
+            else:
+                candidates.append(ids)
+        if location is not None:
+            candidates.append(set(self.locations.get(location.id, ())))
+        if isa is not None:
+            candidates.append({obj.id for obj in isa.descendants()})
+        if candidates:
+            candidates.sort(key=len)
+            ids = candidates[0].intersection(*candidates[1:])
+        else:
+            ids = self.objects.keys()
+        results = []
+        for id in sorted(ids):
+            obj = self.objects[id]
+            for name, condition in unchecked.items():
+                p = obj.find_property(name)
+                if p is None:
+                    break
+                elif isinstance(condition, Range):
+                    if not condition.matches(p.get()):
+                        break
+                elif p.get() != condition:
+                    break
+            else:
+                results.append(obj)
+        return results
+
+    def update_location_index(self, obj, old, new):
+        """Move Object instance obj from the location with the ID old to the
+        location with the ID new in self.locations. Either ID can be None,
+        meaning nowhere."""
+        with self.lock:
+            if old is not None:
+                ids = self.locations.get(old)
+                if ids is not None:
+                    ids.discard(obj.id)
+                    if not ids:
+                        del self.locations[old]
+            if new is not None:
+                self.locations.setdefault(new, set()).add(obj.id)
+
+    def find_references(self, value):
+        """Return the set of IDs of all the objects found somewhere in
+        value, which can contain ObjectReference instances, or be an
+        UnresolvedValue instance, instead of objects."""
+        ids = set()
+        values = [value]
+        while values:
+            value = values.pop()
+            if isinstance(value, self.object_class):
+                if value.id is not None:
+                    ids.add(value.id)
+            elif isinstance(value, ObjectReference):
+                ids.add(value.id)
+            elif isinstance(value, UnresolvedValue):
+                values.append(value.value)
+            elif isinstance(value, list):
+                values.extend(value)
+            elif isinstance(value, dict):
+                values.extend(value.keys())
+                values.extend(value.values())
+        return ids
+
+    def update_references(self, holder, name, old, new):
+        """Update self.references to reflect that the property with the given
+        name on Object instance holder has changed its value from old to
+        new. If new is a list or a dictionary, (holder ID, name) is added to
+        self.containers, since it could be changed in place."""
+        with self.lock:
+            if self.objects.get(holder.id) is not holder:
+                return
+            key = (holder.id, name)
+            old_ids = self.find_references(old)
+            new_ids = self.find_references(new)
+            for id in old_ids.difference(new_ids):
+                keys = self.references.get(id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.references[id]
+            for id in new_ids.difference(old_ids):
+                self.references.setdefault(id, set()).add(key)
+            if isinstance(new, UnresolvedValue):
+                new = new.value
+            if isinstance(new, (list, dict)):
+                self.containers.add(key)
+            else:
+                self.containers.discard(key)
+
+    def mark_containers_dirty(self):
+        """Mark every object in memory which has a list or a dictionary as a
+        property value as changed, since those values could have been changed
+        in place. Objects which a Storage instance has evicted were written
+        back at the time."""
+        if self.read_only:
+            return
+        with self.lock:
+            if self.storage is None:
+                loaded = self.objects
+            else:
+                loaded = self.storage.cache
+            ids = {id for id, name in self.containers}
+            objects = [loaded[id] for id in sorted(ids) if id in loaded]
+            for obj in objects:
+                self.mark_dirty(obj)
+
+    def rebuild_references(self):
+        """Rebuild self.references from scratch. Lists and dictionaries which
+        are modified in place cannot be tracked, so call this method if you
+        have done that."""
+        self.references.clear()
+        self.containers.clear()
+        for obj in self.objects.values():
+            for name, prop in obj._properties.items():
+                if isinstance(prop, self.property_class):
+                    self.update_references(obj, name, None, prop.value)
+
+    def referrers(self, obj):
+        """Return a list of (object, property) tuples, where property is a
+        Property instance on object whose value contains Object instance
+        obj. Lists and dictionaries can be changed in place without updating
+        self.references, so every property in self.containers is checked
+        too."""
+        keys = set(self.references.get(obj.id, ()))
+        for id, name in list(self.containers):
+            if id not in keys and (id, name) not in keys:
+                value = self.objects[id]._properties[name].value
+                if obj.id in self.find_references(value):
+                    keys.add((id, name))
+        results = []
+        for id, name in sorted(keys):
+            thing = self.objects[id]
+            results.append((thing, thing._properties[name]))
+        return results
 
     def dump_value(self, value):
         """Return a properly dumped value. Used for converting Object instances
         to ObjectReference instances."""
         if isinstance(value, self.object_class):
             return ObjectReference(value.id)
+        elif isinstance(value, UnresolvedValue):
+            return value.value
         elif isinstance(value, list):
             return [self.dump_value(entry) for entry in value]
         elif isinstance(value, dict):
@@ -116,16 +852,19 @@ class Database:
         else:
             return value
 
+    def property_type_name(self, p):
+        """Return the name of the type of Property p."""
+        name = self.property_types.name_of(p.type)
+        if name is None:
+            raise RuntimeError('Invalid type on property %r.' % p)
+        return name
+
     def dump_property(self, p):
         """Return Property p as a dictionary."""
-        pt = {y: x for x, y in self.property_types.items()}
-        d = dict(
-            type=pt.get(p.type, None), name=p.name, description=p.description,
-            value=self.dump_value(p.value)
+        return dict(
+            type=self.property_type_name(p), name=p.name,
+            description=p.description, value=self.dump_value(p.value)
         )
-        if d['type'] is None:
-            raise RuntimeError('Invalid type on property %r.' % p)
-        return d
 
     def load_value(self, value):
         """Returns a loaded value."""
@@ -212,27 +951,270 @@ class Database:
                 obj.add_parent(self.objects[id])
         for name, id in d['registered_objects'].items():
             self.register_object(name, self.objects[id])
+        self.checkpoint()
+
+    def encode_json_value(self, value):
+        """Convert a dumped value (as returned by self.dump_value) into
+        something which can be serialised as JSON. Dictionaries are always
+        tagged, so that non-string keys survive the trip."""
+        if isinstance(value, ObjectReference):
+            return {'$ref': value.id}
+        elif isinstance(value, list):
+            return [self.encode_json_value(entry) for entry in value]
+        elif isinstance(value, dict):
+            return {
+                '$dict': [
+                    [self.encode_json_value(x), self.encode_json_value(y)]
+                    for x, y in value.items()
+                ]
+            }
+        elif isinstance(value, datetime):
+            return {'$datetime': value.isoformat()}
+        elif isinstance(value, timedelta):
+            return {
+                '$duration': [value.days, value.seconds, value.microseconds]
+            }
+        else:
+            return value
+
+    def decode_json_value(self, value, ids=None):
+        """Convert a value returned by self.encode_json_value back into a
+        dumped value. If ids is a set, the IDs of any referenced objects will
+        be added to it."""
+        if isinstance(value, list):
+            return [self.decode_json_value(entry, ids) for entry in value]
+        elif isinstance(value, dict):
+            if '$ref' in value:
+                if ids is not None:
+                    ids.add(value['$ref'])
+                return ObjectReference(value['$ref'])
+            elif '$dict' in value:
+                return {
+                    self.decode_json_value(x, ids):
+                    self.decode_json_value(y, ids) for x, y in value['$dict']
+                }
+            elif '$datetime' in value:
+                return datetime.fromisoformat(value['$datetime'])
+            elif '$duration' in value:
+                return timedelta(*value['$duration'])
+            raise ValueError('Invalid value: %r.' % value)
+        else:
+            return value
+
+    def dump_stream(self, fp):
+        """Write this database to the file-like object fp as JSON Lines, one
+        object per line, followed by a line of registered objects. Objects are
+        dumped one at a time, so the whole database is never held in memory
+        in dumped form."""
+        for id in sorted(self.objects):
+            d = self.dump_object(self.objects[id])
+            for datum in d['properties']:
+                datum['value'] = self.encode_json_value(datum['value'])
+            fp.write(json.dumps(dict(object=d)) + '\n')
+        registered_objects = {
+            name: obj.id for name, obj in self.registered_objects.items()
+        }
+        fp.write(
+            json.dumps(
+                dict(
+                    registered_objects=registered_objects,
+                    journal_sequence=self.journal_sequence
+                )
+            )
+        )
+        fp.write('\n')
+
+    def finish_loading_object(self, obj, data):
+        """Load the properties and parents of Object instance obj from a
+        dictionary data."""
+        for datum in data['properties']:
+            self.load_property(obj, datum)
+        for id in data['parents']:
+            obj.add_parent(self.objects[id])
+
+    def load_stream(self, fp):
+        """Load objects from an iterable of JSON Lines fp, as written by
+        self.dump_stream. Each object is loaded as soon as it is read."""
+        registered_objects = {}
+
+        def records():
+            for line in fp:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if 'registered_objects' in record:
+                    registered_objects.update(record['registered_objects'])
+                    self.journal_sequence = record.get('journal_sequence', 0)
+                    continue
+                data = record['object']
+                needed = set(data['parents'])
+                for datum in data['properties']:
+                    datum['value'] = self.decode_json_value(
+                        datum.get('value', None), needed
+                    )
+                yield (data, needed)
+
+        self.load_incrementally(records())
+        for name, id in registered_objects.items():
+            self.register_object(name, self.objects[id])
+        self.checkpoint()
+
+    def load_incrementally(self, records):
+        """Load objects from an iterable of (data, needed) tuples, where data
+        is a dictionary as returned by self.dump_object and needed is the set
+        of IDs of the objects its properties and parents refer to. If any of
+        those objects have not been loaded yet, the properties and parents are
+        loaded once they have."""
+        # Maps the IDs of objects which haven't been loaded yet to lists of
+        # [obj, data, missing_ids] lists which are waiting for them.
+        waiting = {}
+        for data, needed in records:
+            obj = self.load_object(data)
+            needed = {id for id in needed if id not in self.objects}
+            if needed:
+                entry = [obj, data, needed]
+                for id in needed:
+                    waiting.setdefault(id, []).append(entry)
+            else:
+                self.finish_loading_object(obj, data)
+            for entry in waiting.pop(obj.id, []):
+                entry[2].discard(obj.id)
+                if not entry[2]:
+                    self.finish_loading_object(entry[0], entry[1])
+        for entries in waiting.values():
+            for obj, data, missing in entries:
+                raise LoadObjectError(data) from KeyError(min(missing))
+
+    def save_binary(self, filename):
+        """Write this database to a binary snapshot with the given filename.
+        """
+        with open(filename, 'wb') as f:
+            BinaryWriter(self, f).write_database()
+
+    def load_binary(self, filename):
+        """Load objects from the binary snapshot with the given filename, as
+        written by self.save_binary."""
+        with open(filename, 'rb') as f:
+            reader = BinaryReader(self, f.read())
+        self.load_incrementally(reader.read_objects())
+        for name, id in reader.registered_objects.items():
+            self.register_object(name, self.objects[id])
+        self.max_id = max(self.max_id, reader.max_id)
+        self.journal_sequence = reader.journal_sequence
+        self.checkpoint()
 
     def register_object(self, name, obj):
         """Register an Object instance obj with this database. Once registered,
         it will be available as an attribute."""
+        self.check_writable()
         if obj.id is None:
             raise RuntimeError(
                 'Cannot register an anonymous object: %r.' % obj
             )
+        self.record_undo(
+            None, restore_registration, self, name,
+            self.registered_objects.get(name, None)
+        )
         self.registered_objects[name] = obj
+        self.write_journal('register', name=name, id=obj.id)
 
     def unregister_object(self, name):
         """Unregister an Object instance which was previously registered with
         the given name, so it is no longer available as an attribute."""
-        del self.registered_objects[name]
+        self.check_writable()
+        obj = self.registered_objects.pop(name)
+        self.write_journal('unregister', name=name)
+        self.record_undo(None, restore_registration, self, name, obj)
+
+    def validate_all_methods(self, processes=None):
+        """Validate the code of every method on every object. Identical code
+        is only validated once, and unique sources are shared between a pool
+        of processes (the number of which defaults to the number of CPUs).
+        If processes is 1, no pool is used. Returns a dictionary of
+        (object ID, method name): problems, only including methods with
+        problems."""
+        sources = {}
+        owners = {}
+        for obj in list(self.objects.values()):
+            for name, method in obj._methods.items():
+                digest = method.get_digest()
+                sources[digest] = method.code
+                owners[(obj.id, name)] = digest
+        digests = list(sources)
+        codes = [sources[digest] for digest in digests]
+        builtins = [tuple(self.method_globals)] * len(codes)
+        if processes == 1 or len(codes) < 2:
+            results = map(validate_source, codes, builtins)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(
+                    executor.map(
+                        validate_source, codes, builtins,
+                        chunksize=max(1, len(codes) // 64)
+                    )
+                )
+        problems = dict(zip(digests, results))
+        return {
+            key: problems[digest] for key, digest in owners.items()
+            if problems[digest] is not None
+        }
 
     def clear_method_cache(self):
-        """Iterate through all objects and clear their method caches. This can
-        conserve space, and should probably be run periodically on systems
-        where methods change frequently."""
-        for obj in self.objects.values():
-            obj._method_cache.clear()
+        """Forget every bound method in self.bindings. The cache is bounded,
+        so this is only needed to release memory straight away."""
+        self.bindings.clear()
+
+    def start_profiling(self, sink=None):
+        """Start recording calls to methods, and attribute lookups which miss
+        the cache, with a new Profiler instance, which is returned. If sink
+        is not None, it is called after every method call (see Profiler).
+        Bound methods and event handlers are only wrapped while profiling, so
+        there is no cost when it is stopped."""
+        profiler = Profiler(sink=sink)
+        if self.threadsafe:
+            profiler.lock = RLock()
+        self.set_profiler(profiler)
+        return profiler
+
+    def stop_profiling(self):
+        """Stop profiling. Returns the Profiler instance which was in use."""
+        profiler = self.profiler
+        self.set_profiler(None)
+        return profiler
+
+    def set_profiler(self, profiler):
+        """Use profiler, which may be None, and forget every bound method and
+        event handler, so that they are wrapped (or not) when next used."""
+        with self.lock:
+            self.profiler = profiler
+            self.bindings.profiler = profiler
+            self.bindings.clear()
+            if self.storage is None:
+                objects = self.objects.values()
+            else:
+                objects = self.storage.loaded.values()
+            for obj in list(objects):
+                object.__setattr__(obj, '_handlers', None)
+
+    def stats(self):
+        """Return a dictionary of statistics about this database: the number
+        of times each event was dispatched and missed, hits, misses and
+        evictions of self.bindings, and, if profiling, the number of
+        attribute lookups which missed the cache, and a dictionary of
+        (owner ID, method name): dict(calls, total, own, exceptions)."""
+        with self.lock:
+            d = dict(
+                events=dict(self.event_counts),
+                event_misses=dict(self.event_misses),
+                event_dispatches=sum(self.event_counts.values()),
+                binding_hits=self.bindings.hits,
+                binding_misses=self.bindings.misses,
+                binding_evictions=self.bindings.evictions
+            )
+        if self.profiler is not None:
+            d.update(self.profiler.stats())
+        return d
 
     def __getattr__(self, name):
         try:
@@ -25,6 +25,14 @@ class DatabaseError(CarehomeError):
     """There is a problem in the database."""
 
 
+class ReadOnlyError(DatabaseError):
+    """This database cannot be changed."""
+
+
+class DestroyingError(DatabaseError):
+    """This object is being destroyed."""
+
+
 class NoSuchEventError(CarehomeError):
     """No such event."""
 
@@ -49,6 +57,10 @@ class LoadObjectError(LoadError):
     """Error loading an object."""
 
 
+class SnapshotError(LoadError):
+    """A binary snapshot is invalid."""
+
+
 class DestroyError(CarehomeError):
     """Error destroying an object."""
 
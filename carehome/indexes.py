@@ -0,0 +1,149 @@
+"""Provides the Index and Range classes."""
+
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from attr import attrs, attrib, Factory
+
+infinity = float('inf')
+
+
+def sort_group(value):
+    """Return the group of values which value can be sorted with, or None if
+    it cannot be sorted. NaN is not equal to itself, so it cannot be
+    sorted."""
+    if value != value:
+        return None
+    elif isinstance(value, bool):
+        return bool
+    elif isinstance(value, (int, float)):
+        return float
+    elif isinstance(value, datetime):
+        # Naive and aware datetimes cannot be compared with each other.
+        return (datetime, value.utcoffset() is None)
+    elif isinstance(value, (str, timedelta)):
+        return type(value)
+
+
+@attrs
+class Range:
+    """A range of values, for use with Database.query. Either bound can be
+    None, meaning unbounded. By default low is inclusive and high is
+    exclusive."""
+
+    low = attrib(default=Factory(type(None)))
+    high = attrib(default=Factory(type(None)))
+    low_inclusive = attrib(default=Factory(lambda: True))
+    high_inclusive = attrib(default=Factory(bool))
+
+    def matches(self, value):
+        """Return True if value falls within this range. Values which cannot
+        be compared with the bounds, such as NaN, never match."""
+        try:
+            if self.low is not None:
+                if not (
+                    value > self.low or (
+                        value == self.low and self.low_inclusive
+                    )
+                ):
+                    return False
+            if self.high is not None:
+                if not (
+                    value < self.high or (
+                        value == self.high and self.high_inclusive
+                    )
+                ):
+                    return False
+        except TypeError:
+            return False
+        return True
+
+
+@attrs
+class Index:
+    """An index of the values of the property with the given name, including
+    inherited values. Every hashable value can be looked up by equality. If
+    sorted is True, values can also be looked up by range."""
+
+    name = attrib()
+    sorted = attrib(default=Factory(bool))
+    values = attrib(default=Factory(dict), init=False, repr=False)
+    hashed = attrib(default=Factory(dict), init=False, repr=False)
+    ordered = attrib(default=Factory(dict), init=False, repr=False)
+
+    def set(self, id, value):
+        """Note that the object with the given ID has the given value."""
+        if id in self.values:
+            if self.values[id] is value:
+                return
+            self.discard(id)
+        self.values[id] = value
+        try:
+            self.hashed.setdefault(value, set()).add(id)
+        except TypeError:
+            pass  # Unhashable.
+        group = sort_group(value)
+        if self.sorted and group is not None:
+            insort(self.ordered.setdefault(group, []), (value, id))
+
+    def discard(self, id):
+        """Remove the object with the given ID from this index."""
+        if id not in self.values:
+            return
+        value = self.values.pop(id)
+        try:
+            ids = self.hashed.get(value, None)
+        except TypeError:
+            ids = None
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del self.hashed[value]
+        group = sort_group(value)
+        if self.sorted and group is not None:
+            entries = self.ordered[group]
+            entry = (value, id)
+            index = bisect_left(entries, entry)
+            if index < len(entries) and entries[index] == entry:
+                del entries[index]
+            elif entry in entries:
+                entries.remove(entry)
+
+    def update(self, obj):
+        """Update the entry for Object instance obj."""
+        p = obj.find_property(self.name)
+        if p is None:
+            self.discard(obj.id)
+        else:
+            self.set(obj.id, p.get())
+
+    def equal(self, value):
+        """Return the set of IDs of objects with the given value, or None if
+        value is unhashable."""
+        try:
+            return set(self.hashed.get(value, ()))
+        except TypeError:
+            pass
+
+    def range(self, r):
+        """Return the set of IDs of objects whose values fall within Range
+        instance r, or None if this index cannot answer the question."""
+        bounds = [bound for bound in (r.low, r.high) if bound is not None]
+        if not self.sorted or not bounds:
+            return None
+        group = sort_group(bounds[0])
+        if group is None or any(sort_group(x) != group for x in bounds):
+            return None
+        entries = self.ordered.get(group, [])
+        if r.low is None:
+            start = 0
+        elif r.low_inclusive:
+            start = bisect_left(entries, (r.low,))
+        else:
+            start = bisect_right(entries, (r.low, infinity))
+        if r.high is None:
+            end = len(entries)
+        elif r.high_inclusive:
+            end = bisect_right(entries, (r.high, infinity))
+        else:
+            end = bisect_left(entries, (r.high,))
+        return {id for value, id in entries[start:end]}
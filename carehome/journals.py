@@ -0,0 +1,59 @@
+"""Provides the Journal class."""
+
+import os
+import json
+from attr import attrs, attrib, Factory
+
+
+@attrs
+class Journal:
+    """An append-only file of changes made to a database. Records are flushed
+    to disk every sync_every writes, or whenever sync is called."""
+
+    filename = attrib()
+    sync_every = attrib(default=Factory(lambda: 100))
+    file = attrib(default=Factory(type(None)), init=False, repr=False)
+    pending = attrib(default=Factory(int), init=False)
+
+    def __attrs_post_init__(self):
+        self.file = open(self.filename, 'a')
+
+    def write(self, record):
+        """Append a dictionary record to this journal."""
+        self.file.write(json.dumps(record) + '\n')
+        self.pending += 1
+        if self.pending >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        """Make sure all records have been written to disk."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def truncate(self):
+        """Remove all records from this journal."""
+        self.file.seek(0)
+        self.file.truncate()
+        self.sync()
+
+    def close(self):
+        """Sync and close this journal."""
+        self.sync()
+        self.file.close()
+
+    @staticmethod
+    def read(filename):
+        """Yield every record from the journal with the given filename. A
+        record which was only partially written when the program crashed is
+        ignored."""
+        if not os.path.isfile(filename):
+            return
+        with open(filename, 'r') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    break
@@ -0,0 +1,36 @@
+"""Provides the LockStripes class."""
+
+from contextlib import contextmanager
+from threading import RLock
+from attr import attrs, attrib, Factory
+
+
+@attrs
+class LockStripes:
+    """A fixed number of re-entrant locks, shared between objects according to
+    their IDs, so that changes to unrelated objects rarely wait for each
+    other. Locks are always acquired in ascending order, so two threads can
+    never each hold a lock the other is waiting for."""
+
+    count = attrib(default=Factory(lambda: 64))
+    locks = attrib(default=Factory(list), init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self.locks = [RLock() for x in range(self.count)]
+
+    def stripes(self, *ids):
+        """Return the sorted list of the stripes used by the given IDs. IDs
+        which are None are ignored."""
+        return sorted({id % self.count for id in ids if id is not None})
+
+    @contextmanager
+    def hold(self, *ids):
+        """Hold the locks for the objects with the given IDs."""
+        locks = [self.locks[stripe] for stripe in self.stripes(*ids)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
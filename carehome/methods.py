@@ -2,17 +2,85 @@
 
 import os
 import os.path
-from inspect import isfunction
-from subprocess import Popen, PIPE
+import ast
+import marshal
+from hashlib import sha256
+from importlib.util import MAGIC_NUMBER
+from inspect import isfunction, iscoroutinefunction
 from attr import attrs, attrib, Factory
 try:
-    import flake8
+    from pyflakes.checker import Checker
 except ImportError:
-    flake8 = None
-from .exc import Flake8NotFound
+    Checker = None
+try:
+    from flake8.plugins.pyflakes import FLAKE8_PYFLAKES_CODES
+except ImportError:
+    FLAKE8_PYFLAKES_CODES = {}
+try:
+    import pycodestyle
+except ImportError:
+    pycodestyle = None
 
 NoneType = type(None)
 
+if pycodestyle is not None:
+    class StyleReport(pycodestyle.BaseReport):
+        """Collect the problems found by pycodestyle instead of printing
+        them."""
+
+        def init_file(self, *args, **kwargs):
+            super().init_file(*args, **kwargs)
+            self.problems = []
+
+        def error(self, line_number, offset, text, check):
+            code = super().error(line_number, offset, text, check)
+            if code:
+                self.problems.append((line_number, offset + 1, text))
+            return code
+
+
+def validate_source(code, builtins=()):
+    """Check code for problems, returning either None or a string containing
+    one problem per line, in the same format as flake8. Code is checked with
+    pyflakes and pycodestyle, using flake8's default settings. If they are
+    not installed, only errors found by compiling the code are reported."""
+    try:
+        tree = ast.parse(code, filename='stdin')
+        compile(tree, 'stdin', 'exec')
+    except SyntaxError as e:
+        problems = [
+            (
+                e.lineno or 1, e.offset or 1,
+                'E999 %s: %s' % (type(e).__name__, e.msg)
+            )
+        ]
+    else:
+        problems = []
+        if Checker is not None:
+            checker = Checker(tree, filename='stdin', builtins=builtins)
+            for message in checker.messages:
+                name = FLAKE8_PYFLAKES_CODES.get(type(message).__name__, 'F')
+                problems.append(
+                    (
+                        message.lineno, message.col + 1, '%s %s' % (
+                            name, message.message % message.message_args
+                        )
+                    )
+                )
+        if pycodestyle is not None:
+            options = pycodestyle.StyleGuide(quiet=True).options
+            report = StyleReport(options)
+            pycodestyle.Checker(
+                'stdin', lines=code.splitlines(True), options=options,
+                report=report
+            ).check_all()
+            problems.extend(report.problems)
+    if problems:
+        return ''.join(
+            'stdin:%d:%d: %s%s' % (line, column, text, os.linesep)
+            for line, column, text in sorted(problems)
+        )
+
 
 @attrs
 class Method:
@@ -23,16 +91,13 @@ class Method:
     name = attrib(default=Factory(NoneType))
     func = attrib(default=Factory(NoneType), init=False)
     created = attrib(default=Factory(dict), init=False)
+    coroutine = attrib(default=Factory(bool), init=False)
 
     def __attrs_post_init__(self):
         g = globals().copy()
         g.update(**self.database.method_globals)
         old_names = set(g.keys())
-        n = self.get_filename()
-        with open(n, 'w') as f:
-            f.write(self.code)
-        source = compile(self.code, n, 'exec')
-        eval(source, g)
+        eval(self.get_code_object(), g)
         new_names = set(g.keys())
         for name in new_names.difference(old_names):
             f = g[name]
@@ -42,26 +107,53 @@ class Method:
         if self.name is None:
             raise RuntimeError('No function found.')
         self.func = self.created[self.name]
+        self.coroutine = iscoroutinefunction(self.func)
+
+    def get_digest(self):
+        """Get a hash of this method's code."""
+        return sha256(self.code.encode()).hexdigest()
 
     def get_filename(self):
-        """Get a unique filename for this method."""
+        """Get the filename for this method. Methods with identical code share
+        the same file."""
         return os.path.join(
-            self.database.methods_dir, '%s-%d.method' % (self.name, id(self))
+            self.database.methods_dir, '%s.method' % self.get_digest()
         )
 
+    def get_code_object(self):
+        """Get a compiled code object for this method. Code objects are cached
+        by the database, so identical code is only compiled once. If
+        database.bytecode_cache is True, compiled code is also stored
+        alongside the method file, so it need not be compiled again when the
+        database is next loaded."""
+        digest = self.get_digest()
+        cache = self.database.code_cache
+        if digest in cache:
+            return cache[digest]
+        n = self.get_filename()
+        marshal_filename = os.path.splitext(n)[0] + '.marshal'
+        source = None
+        if self.database.bytecode_cache and os.path.isfile(marshal_filename):
+            with open(marshal_filename, 'rb') as f:
+                data = f.read()
+            if data.startswith(MAGIC_NUMBER):
+                try:
+                    source = marshal.loads(data[len(MAGIC_NUMBER):])
+                except (EOFError, ValueError, TypeError):
+                    source = None
+        if not os.path.isfile(n):
+            with open(n, 'w') as f:
+                f.write(self.code)
+        if source is None:
+            source = compile(self.code, n, 'exec')
+            if self.database.bytecode_cache:
+                with open(marshal_filename, 'wb') as f:
+                    f.write(MAGIC_NUMBER + marshal.dumps(source))
+        cache[digest] = source
+        return source
+
     def validate_code(self):
-        """This method by default uses Flake8 to check your code. It should
-        return either None to indicate no errors, or a string containing any
-        problems found."""
-        if flake8 is None:
-            raise Flake8NotFound()
-        builtins = ','.join(self.database.method_globals.keys())
-        p = Popen(
-            ('flake8', '--builtins=%s' % builtins, '-'), stdin=PIPE,
-            stdout=PIPE, stderr=PIPE
-        )
-        stdout, stderr = p.communicate(self.code.encode())
-        if stdout:
-            return stdout.decode()
-        elif stderr:
-            return stderr.decode()
+        """Check this method's code with validate_source, treating the names
+        in database.method_globals as builtins. Returns either None to
+        indicate no errors, or a string containing any problems found."""
+        return validate_source(self.code, tuple(self.database.method_globals))
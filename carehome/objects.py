@@ -1,50 +1,146 @@
-"""Provides the Object class."""
+"""Provides the Object and CompactObject classes."""
 
+from inspect import isawaitable
 from types import MethodType
-from attr import attrs, attrib, Factory
-from .exc import DuplicateParentError, ParentIsChildError, NoSuchEventError
+from attr import attrs, attrib, fields, Factory
+from .exc import (
+    DuplicateParentError, ParentIsChildError, NoSuchEventError, DestroyingError
+)
+from .transactions import restore_location, restore_method
 
 NoneType = type(None)
 
 
-@attrs
-class Object:
-    """An object with multiple parents and multiple children."""
+reserved = {}
+
+
+def reserved_attributes(cls):
+    """Return a frozenset of the names which, when set on an instance of class
+    cls, are set as normal attributes rather than as properties. That is
+    every attribute of the class itself, and every attrs attribute. The
+    result is computed once per class, so attributes added to cls later are
+    not noticed."""
+    try:
+        return reserved[cls]
+    except KeyError:
+        names = set(dir(cls))
+        names.update(a.name for a in fields(cls))
+        reserved[cls] = frozenset(names)
+        return reserved[cls]
+
+
+def is_initialised(obj):
+    """Return True if Object instance obj has finished initialising, without
+    falling back to its __getattr__ method."""
+    try:
+        return object.__getattribute__(obj, '__initialised__')
+    except AttributeError:
+        return False
+
+
+class ResolutionDict(dict):
+    """A dictionary which tells its owner to forget cached attribute lookups
+    whenever it is modified. Used for Object._methods and Object._properties.
+    """
+
+    __slots__ = ('owner',)
+
+    def __init__(self, owner, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.owner = owner
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        self.owner.invalidate_resolution()
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self.owner.invalidate_resolution()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self.owner.invalidate_resolution()
+        return value
+
+    def popitem(self):
+        value = super().popitem()
+        self.owner.invalidate_resolution()
+        return value
+
+    def setdefault(self, name, default=None):
+        value = super().setdefault(name, default)
+        self.owner.invalidate_resolution()
+        return value
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.owner.invalidate_resolution()
+
+    def clear(self):
+        super().clear()
+        self.owner.invalidate_resolution()
+
+
+def c3_merge(sequences):
+    """Merge sequences of objects as per the C3 linearization algorithm.
+    Objects are compared by identity. Returns None if there is no consistent
+    ordering."""
+    sequences = [list(sequence) for sequence in sequences if sequence]
+    result = []
+    while sequences:
+        for sequence in sequences:
+            head = sequence[0]
+            if not any(
+                thing is head for other in sequences for thing in other[1:]
+            ):
+                break
+        else:
+            return None
+        result.append(head)
+        for sequence in sequences:
+            if sequence[0] is head:
+                del sequence[0]
+        sequences = [sequence for sequence in sequences if sequence]
+    return result
+
+
+class BaseObject:
+    """The behaviour shared by Object and CompactObject. Subclasses must be
+    attrs classes with the attributes returned by object_attributes."""
 
-    database = attrib()
-    _parents = attrib(default=Factory(list))
-    _children = attrib(default=Factory(list))
-    _methods = attrib(default=Factory(dict))
-    _properties = attrib(default=Factory(dict))
-    id = attrib(default=Factory(type(None)))
-    _method_cache = attrib(default=Factory(dict), init=False, repr=False)
-    _location = attrib(default=Factory(NoneType))
+    __slots__ = ()
 
     def __attrs_post_init__(self):
+        self._methods = ResolutionDict(self, self._methods)
+        self._properties = ResolutionDict(self, self._properties)
         self.__initialised__ = True
 
     def __setattr__(self, name, value):
-        initialised = '__initialised__' in self.__dict__
-        reserved_names = ('__initialised__', 'id')
-        if initialised and name in reserved_names:
+        if not is_initialised(self):
+            return super().__setattr__(name, value)
+        if name in reserved_attributes(type(self)):
+            if name in ('__initialised__', 'id'):
                 raise RuntimeError(
                     'You cannot set this attribute after initialisation.'
                 )
-        if not initialised or (
-            name in self.__dict__ or name in dir(self.database.object_class)
-        ):
             return super().__setattr__(name, value)
-        elif name in self._properties:
-            self._properties[name].set(value)
+        prop = self._properties.get(name, None)
+        if prop is not None:
+            return prop.set(value)
+        result = self.resolve(name)
+        if result is not None and isinstance(
+            result[1], self.database.property_class
+        ):
+            prop = result[1]
         else:
             prop = self.find_property(name)
-            if prop is None:
-                t = type(value)
-                description = 'Added by __setattr__.'
-            else:
-                t = prop.type
-                description = prop.description
-            self.add_property(name, t, value, description=description)
+        if prop is None:
+            t = type(value)
+            description = 'Added by __setattr__.'
+        else:
+            t = prop.type
+            description = prop.description
+        self.add_property(name, t, value, description=description)
 
     @property
     def parents(self):
@@ -52,6 +148,8 @@ class Object:
 
     @property
     def children(self):
+        if not self._children_loaded:
+            self.database.objects.load_children(self)
         return self._children.copy()
 
     @property
@@ -63,18 +161,137 @@ class Object:
         return self._properties.keys()
 
     def descendants(self):
-        """Return all descendants of this object."""
-        for child in self._children:
-            yield child
-            for descendant in child.descendants():
-                yield descendant
+        """Return all descendants of this object, depth first. Objects which
+        are reachable by more than one route are only yielded once."""
+        seen = set()
+        stack = [iter(self.children)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+            elif id(child) not in seen:
+                seen.add(id(child))
+                yield child
+                stack.append(iter(child.children))
 
     def ancestors(self):
-        """Return all the ancestors of this object."""
-        for parent in self._parents:
-            yield parent
-            for ancestor in parent.ancestors():
-                yield ancestor
+        """Return all the ancestors of this object, depth first. Objects which
+        are reachable by more than one route are only yielded once."""
+        seen = set()
+        stack = [iter(self.parents)]
+        while stack:
+            parent = next(stack[-1], None)
+            if parent is None:
+                stack.pop()
+            elif id(parent) not in seen:
+                seen.add(id(parent))
+                yield parent
+                stack.append(iter(parent.parents))
+
+    def isa(self, obj):
+        """Return True if obj is this object or one of its ancestors. The set
+        of ancestors is cached until the hierarchy changes, so this is a
+        single set lookup."""
+        if obj is self:
+            return True
+        ancestor_ids = self._ancestor_ids
+        if ancestor_ids is None:
+            epoch = self._epoch
+            ancestor_ids = frozenset(
+                id(ancestor) for ancestor in self.resolution_order()[1:]
+            )
+            object.__setattr__(self, '_ancestor_ids', ancestor_ids)
+            if self._epoch != epoch:
+                # The hierarchy changed in another thread.
+                object.__setattr__(self, '_ancestor_ids', None)
+        return id(obj) in ancestor_ids
+
+    def resolution_order(self):
+        """Return the C3 linearization of this object and its ancestors, which
+        is the order in which attributes are searched for. If the hierarchy
+        cannot be linearized, ancestors are searched depth first. The result
+        is cached until the hierarchy changes."""
+        mro = self._mro
+        if mro is None:
+            epoch = self._epoch
+            parents = list(self._parents)
+            mro = c3_merge(
+                [parent.resolution_order() for parent in parents] + [parents]
+            )
+            if mro is None:
+                mro = list(self.ancestors())
+            mro.insert(0, self)
+            mro = tuple(mro)
+            object.__setattr__(self, '_mro', mro)
+            if self._epoch != epoch:
+                # The hierarchy changed in another thread.
+                object.__setattr__(self, '_mro', None)
+        return mro
+
+    def invalidate_resolution(self, hierarchy=False):
+        """Forget cached attribute lookups for this object and all of its
+        descendants. If hierarchy is True, forget cached resolution orders
+        too. Objects which have been evicted from storage but are still in
+        use are not in their parents' lists of children, so they are always
+        included."""
+        objects = [self]
+        storage = self.database.storage
+        if storage is not None and storage.detached and not storage.loading:
+            objects.extend(storage.detached.values())
+        seen = set()
+        while objects:
+            obj = objects.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            obj.forget_resolution(hierarchy=hierarchy)
+            objects.extend(obj._children)
+
+    def forget_resolution(self, hierarchy=False):
+        """Forget cached attribute lookups for this object only, and its
+        cached resolution order too if hierarchy is True. Caches are replaced
+        rather than cleared, so a lookup which was running in another thread
+        can only store its result in the old cache. The resolution order is
+        forgotten before the caches are replaced, so a lookup which finds
+        the new cache can never use the old resolution order. New caches are
+        only made when they are next needed."""
+        if hierarchy:
+            object.__setattr__(self, '_epoch', self._epoch + 1)
+            object.__setattr__(self, '_mro', None)
+            object.__setattr__(self, '_ancestor_ids', None)
+        object.__setattr__(self, '_resolution', None)
+        object.__setattr__(self, '_handlers', None)
+        self.database.bindings.discard(self.id)
+
+    def resolve(self, name):
+        """Return a tuple of (owner, value), where value is the method or
+        property named name found on owner, or None if no such method or
+        property exists on this object or any of its ancestors."""
+        cache = self._resolution
+        if cache is None:
+            # Store the cache before finding the resolution order, so that if
+            # either is forgotten in the meantime, the result is thrown away.
+            cache = {}
+            object.__setattr__(self, '_resolution', cache)
+        else:
+            try:
+                return cache[name]
+            except KeyError:
+                pass
+        for obj in self.resolution_order():
+            try:
+                result = (obj, obj.method_or_property(name))
+                break
+            except AttributeError:
+                pass
+        else:
+            result = None
+        profiler = self.database.profiler
+        if profiler is not None:
+            with profiler.lock:
+                profiler.resolution_misses += 1
+        cache[name] = result
+        return result
 
     @property
     def location(self):
@@ -86,6 +303,7 @@ class Object:
         """Set the location of this object to a destination where. Note that
         where must either be an Object instance, or None, which means
         nowhere."""
+        self.database.check_writable()
         if self._location is not None:
             self.location.try_event('on_exit', self.location, self)
         if obj is None:
@@ -93,96 +311,187 @@ class Object:
         else:
             obj.try_event('on_enter', obj, self)
             value = obj.id
-        self.__dict__['_location'] = value
+        while True:
+            old = self._location
+            with self.database.locked(self.id, old, value):
+                # Another thread may have moved this object before the locks
+                # were taken, in which case they are the wrong ones.
+                if self._location != old:
+                    continue
+                if value in self.database.destroying:
+                    raise DestroyingError(obj)
+                if self.database.objects.get(self.id) is self:
+                    self.database.update_location_index(self, old, value)
+                object.__setattr__(self, '_location', value)
+                break
+        self.database.mark_dirty(self, 'move', location=value)
+        self.database.record_undo(self, restore_location, self, old)
 
     @property
     def contents(self):
-        objects = self.database.objects.values()
-        return [x for x in objects if x.location is self]
+        objects = self.database.objects
+        with self.database.lock:
+            ids = sorted(self.database.locations.get(self.id, ()))
+            return [objects[id] for id in ids]
+
+    @property
+    def contents_count(self):
+        return len(self.database.locations.get(self.id, ()))
+
+    @property
+    def has_contents(self):
+        return bool(self.database.locations.get(self.id))
 
-    def add_parent(self, obj):
-        """Add a parent to this object."""
+    def add_parent(self, obj, index=None):
+        """Add a parent to this object. If index is None, the new parent is
+        searched after all the others, otherwise it is inserted before the
+        parent at index."""
         assert isinstance(obj, type(self))
-        if obj in self.descendants():
-            raise ParentIsChildError(self, obj)
-        if obj in self.ancestors() or obj is self:
-            raise DuplicateParentError(self, obj)
+        self.database.check_writable()
+        self.check_parent(obj)
         self.try_event('on_add_parent', self, obj)
         obj.try_event('on_add_child', obj, self)
-        self._parents.append(obj)
-        obj._children.append(self)
+        self.link_parent(obj, index)
+
+    async def aadd_parent(self, obj, index=None):
+        """Like add_parent, but awaits the on_add_parent and on_add_child
+        events, so they can be coroutine functions."""
+        assert isinstance(obj, type(self))
+        self.database.check_writable()
+        self.check_parent(obj)
+        await self.atry_event('on_add_parent', self, obj)
+        await obj.atry_event('on_add_child', obj, self)
+        self.link_parent(obj, index)
+
+    def link_parent(self, obj, index=None):
+        """Add obj to the parents of this object without firing any
+        events."""
+        with self.database.locked(
+            self.id, *(ancestor.id for ancestor in obj.resolution_order())
+        ):
+            if self.database.threadsafe:
+                self.check_parent(obj)
+            if index is None:
+                self._parents.append(obj)
+            else:
+                self._parents.insert(index, obj)
+            obj._children.append(self)
+            self.invalidate_resolution(hierarchy=True)
+        if index is None:
+            self.database.mark_dirty(self, 'add_parent', parent=obj.id)
+        else:
+            self.database.mark_dirty(
+                self, 'add_parent', parent=obj.id, index=index
+            )
+        self.database.record_undo(self, self.remove_parent, obj)
+
+    def check_parent(self, obj):
+        """Raise an error if obj cannot be added as a parent of this
+        object."""
+        if obj.id in self.database.destroying:
+            raise DestroyingError(obj)
+        if obj is not self and obj.isa(self):
+            raise ParentIsChildError(self, obj)
+        if self.isa(obj):
+            raise DuplicateParentError(self, obj)
 
     def remove_parent(self, obj):
         """Remove a parent from this object."""
+        self.database.check_writable()
         self.try_event('on_remove_parent', self, obj)
         obj.try_event('on_remove_child', obj, self)
-        self._parents.remove(obj)
-        obj._children.remove(self)
+        self.unlink_parent(obj)
+
+    async def aremove_parent(self, obj):
+        """Like remove_parent, but awaits the on_remove_parent and
+        on_remove_child events."""
+        self.database.check_writable()
+        await self.atry_event('on_remove_parent', self, obj)
+        await obj.atry_event('on_remove_child', obj, self)
+        self.unlink_parent(obj)
+
+    def unlink_parent(self, obj):
+        """Remove obj from the parents of this object without firing any
+        events."""
+        with self.database.locked(self.id, obj.id):
+            index = [id(parent) for parent in self._parents].index(id(obj))
+            del self._parents[index]
+            obj._children.remove(self)
+            self.invalidate_resolution(hierarchy=True)
+        self.database.mark_dirty(self, 'remove_parent', parent=obj.id)
+        self.database.record_undo(self, self.add_parent, obj, index)
 
     def method_or_property(self, attribute):
         """Get a method or property with the given name."""
-        d = {}
-        for dictionary in (self._properties, self._methods):
-            d.update(dictionary)
-        for name, value in d.items():
-            if name == attribute:
-                return value
-        raise AttributeError(attribute)
+        value = self._methods.get(attribute, None)
+        if value is None:
+            value = self._properties.get(attribute, None)
+            if value is None:
+                raise AttributeError(attribute)
+        return value
 
     def __getattr__(self, name, *args, **kwargs):
         """Find a property or method matching the given name."""
-        try:
-            value = self.method_or_property(name)
-        except AttributeError:
-            for ancestor in self.ancestors():
-                try:
-                    value = ancestor.method_or_property(name)
-                    break
-                except AttributeError:
-                    pass
-            else:
-                return super().__getattribute__(name, *args, **kwargs)
+        if not is_initialised(self):
+            return super().__getattribute__(name, *args, **kwargs)
+        result = self.resolve(name)
+        if result is None:
+            return super().__getattribute__(name, *args, **kwargs)
+        owner, value = result
         if isinstance(value, self.database.property_class):
             return value.get()
         elif isinstance(value, self.database.method_class):
-            num = id(value.func)
-            if num not in self._method_cache:
-                self._method_cache[num] = MethodType(value.func, self)
-            return self._method_cache[num]
+            return self.database.bindings.get(self, name, value, owner)
         else:
             return value
 
     def add_property(self, name, type, value, description=None):
         """Add a property to this Object."""
+        self.database.check_writable()
         if name in self._properties:
             raise NameError('Duplicate property name: %r.' % name)
-        for cls in self.database.property_types.values():
-            if cls is type:
-                break
-        else:
+        if self.database.property_types.name_of(type) is None:
             raise TypeError(
                 'Invalid property type for %r.%s (value=%r): %r.' % (
                     self, name, value, type
                 )
             )
-        if not isinstance(value, (NoneType, type)):
+        if (
+            value is not None and value.__class__ is not type and
+            not isinstance(value, type)
+        ):
             raise TypeError('Value %r is not of type %r.' % (value, type))
         p = self.database.property_class(name, description, type, value)
         self.try_event('on_add_property', self, p)
         self._properties[name] = p
+        p.owner = self
+        self.database.update_references(self, name, None, p.value)
+        self.database.mark_dirty(
+            self, 'add_property', name=name, description=description,
+            type=p.type, value=p.value
+        )
+        self.database.record_undo(self, self.remove_property, name)
         return p
 
     def remove_property(self, name):
         """Remove a property from this object."""
+        self.database.check_writable()
         self.try_event('on_remove_property', self, name)
-        del self._properties[name]
+        p = self._properties.pop(name)
+        if isinstance(p, self.database.property_class):
+            self.database.update_references(self, name, p.value, None)
+            if self.database.undo_log is not None:
+                self.database.record_undo(
+                    self, self.add_property, name, p.type, p.get(),
+                    p.description
+                )
+            p.owner = None
+        self.database.mark_dirty(self, 'remove_property', name=name)
 
     def find_property(self, name):
         """Fnd a property with the given name and return it."""
-        objects = [self]
-        objects.extend(self.ancestors())
-        for obj in objects:
-            if name in obj.properties:
+        for obj in self.resolution_order():
+            if name in obj._properties:
                 return obj._properties[name]
 
     def add_method(self, *args, **kwargs):
@@ -190,26 +499,152 @@ class Object:
         constructor. The first method argument must be self or similar, so this
         object can be available from within the function itself. Methods can
         not be added to anonymous objects (those with no IDs)."""
+        self.database.check_writable()
         if self.id is None:
             raise RuntimeError('Methods cannot be added to anonymous objects.')
         m = self.database.method_class(self.database, *args, **kwargs)
+        previous = self._methods.get(m.name, None)
         self._methods[m.name] = m
+        self.database.mark_dirty(self, 'add_method', name=m.name, code=m.code)
+        self.database.record_undo(
+            self, restore_method, self, m.name, previous
+        )
         return m
 
     def remove_method(self, name):
         """Remove a method from this object."""
-        del self._methods[name]
+        self.database.check_writable()
+        m = self._methods.pop(name)
+        self.database.mark_dirty(self, 'remove_method', name=name)
+        self.database.record_undo(self, restore_method, self, name, m)
+
+    def get_handler(self, name):
+        """Return a callable which handles the named event, or None. Handlers
+        which are methods (and the absence of a handler) are cached until
+        this object's methods, properties or ancestors change."""
+        cache = self._handlers
+        if cache is None:
+            cache = {}
+            object.__setattr__(self, '_handlers', cache)
+        else:
+            try:
+                return cache[name]
+            except KeyError:
+                pass
+        result = self.resolve(name)
+        if result is None:
+            handler = None
+        elif isinstance(result[1], self.database.method_class):
+            handler = MethodType(result[1].func, self)
+            profiler = self.database.profiler
+            if profiler is not None:
+                handler = profiler.wrap(handler, result[0], name)
+        else:
+            # Property values can change without notice, so don't cache them.
+            handler = getattr(self, name)
+            return handler if callable(handler) else None
+        cache[name] = handler
+        return handler
 
     def do_event(self, name, *args, **kwargs):
         """Call the named event with the given args and kwargs."""
-        if callable(getattr(self, name, None)):
-            return getattr(self, name)(*args, **kwargs)
-        raise NoSuchEventError(self, name, args, kwargs)
+        handler = self.get_handler(name)
+        if handler is None:
+            raise NoSuchEventError(self, name, args, kwargs)
+        self.database.event_counts[name] += 1
+        return handler(*args, **kwargs)
 
     def try_event(self, name, *args, **kwargs):
         """Tries to run the given event. The return value is either None if the
-        event is not present, or the return value of the vent method."""
-        try:
-            return self.do_event(name, *args, **kwargs)
-        except NoSuchEventError:
-            pass
+        event is not present, or the return value of the vent method. No events
+        are run while Database.suppressing_events is True, and events are
+        queued (returning None) inside Database.batch_events."""
+        if self.database.suppressing_events:
+            return
+        if self.database.event_queue is not None:
+            self.database.event_queue.append((self, name, args, kwargs))
+            return
+        handler = self.get_handler(name)
+        if handler is None:
+            self.database.event_misses[name] += 1
+            return
+        self.database.event_counts[name] += 1
+        if getattr(handler, 'batched', False):
+            return handler([(args, kwargs)])
+        return handler(*args, **kwargs)
+
+    async def ado_event(self, name, *args, **kwargs):
+        """Like do_event, but awaits the handler if it is a coroutine
+        function. Synchronous handlers are called inline."""
+        handler = self.get_handler(name)
+        if handler is None:
+            raise NoSuchEventError(self, name, args, kwargs)
+        self.database.event_counts[name] += 1
+        result = handler(*args, **kwargs)
+        if isawaitable(result):
+            result = await result
+        return result
+
+    async def atry_event(self, name, *args, **kwargs):
+        """Like try_event, but awaits the handler if it is a coroutine
+        function. Events are never queued by Database.batch_events, since
+        delivering them would need an event loop."""
+        if self.database.suppressing_events:
+            return
+        handler = self.get_handler(name)
+        if handler is None:
+            self.database.event_misses[name] += 1
+            return
+        self.database.event_counts[name] += 1
+        if getattr(handler, 'batched', False):
+            result = handler([(args, kwargs)])
+        else:
+            result = handler(*args, **kwargs)
+        if isawaitable(result):
+            result = await result
+        return result
+
+
+def object_attributes():
+    """Return a dictionary of the attributes of Object and CompactObject, for
+    use as the these argument to attrs."""
+    return dict(
+        database=attrib(),
+        _parents=attrib(default=Factory(list)),
+        _children=attrib(default=Factory(list)),
+        _methods=attrib(default=Factory(dict)),
+        _properties=attrib(default=Factory(dict)),
+        id=attrib(default=Factory(type(None))),
+        _location=attrib(default=Factory(NoneType)),
+        _mro=attrib(
+            default=Factory(NoneType), init=False, repr=False, eq=False
+        ),
+        _ancestor_ids=attrib(
+            default=Factory(NoneType), init=False, repr=False, eq=False
+        ),
+        _handlers=attrib(
+            default=Factory(NoneType), init=False, repr=False, eq=False
+        ),
+        _resolution=attrib(
+            default=Factory(NoneType), init=False, repr=False, eq=False
+        ),
+        _children_loaded=attrib(
+            default=Factory(lambda: True), init=False, repr=False, eq=False
+        ),
+        _epoch=attrib(default=Factory(int), init=False, repr=False, eq=False),
+        __initialised__=attrib(
+            default=Factory(bool), init=False, repr=False, eq=False
+        )
+    )
+
+
+@attrs(these=object_attributes())
+class Object(BaseObject):
+    """An object with multiple parents and multiple children."""
+
+
+@attrs(these=object_attributes(), slots=True)
+class CompactObject(BaseObject):
+    """An Object without a __dict__, which uses much less memory. Use it by
+    passing object_class=CompactObject to Database. Unlike Object, instances
+    cannot be given arbitrary attributes which are not properties."""
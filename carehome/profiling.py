@@ -0,0 +1,134 @@
+"""Provides the Profiler class, used by Database.start_profiling."""
+
+from contextlib import nullcontext
+from inspect import iscoroutinefunction
+from threading import local
+from time import perf_counter
+from attr import attrs, attrib, Factory
+
+
+@attrs(slots=True)
+class MethodStats:
+    """Statistics for one method. Times are in seconds, and own excludes the
+    time spent in other profiled methods called by this one."""
+
+    calls = attrib(default=Factory(int))
+    total = attrib(default=Factory(float))
+    own = attrib(default=Factory(float))
+    exceptions = attrib(default=Factory(int))
+
+
+class ProfiledMethod:
+    """Wraps a bound method, so that calls are recorded in a MethodStats
+    instance by a Profiler. The __func__ and __self__ attributes of the bound
+    method are available, as are the attributes of its function."""
+
+    __slots__ = ('__func__', '__self__', 'bound', 'key', 'stats', 'profiler')
+
+    def __init__(self, bound, key, stats, profiler):
+        self.__func__ = bound.__func__
+        self.__self__ = bound.__self__
+        self.bound = bound
+        self.key = key
+        self.stats = stats
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.__func__, name)
+
+    def __call__(self, *args, **kwargs):
+        profiler = self.profiler
+        local = profiler.local
+        try:
+            stack = local.stack
+        except AttributeError:
+            stack = local.stack = []
+        stack.append(0.0)
+        exception = None
+        started = perf_counter()
+        try:
+            return self.bound(*args, **kwargs)
+        except BaseException as e:
+            exception = e
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            own = elapsed - stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            profiler.record(self, elapsed, own, exception)
+
+
+class AsyncProfiledMethod(ProfiledMethod):
+    """Like ProfiledMethod, but for coroutine functions. Time is measured
+    until the coroutine finishes, including any time spent waiting, so own
+    is always the same as total."""
+
+    __slots__ = ()
+
+    async def __call__(self, *args, **kwargs):
+        exception = None
+        started = perf_counter()
+        try:
+            return await self.bound(*args, **kwargs)
+        except BaseException as e:
+            exception = e
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            self.profiler.record(self, elapsed, elapsed, exception)
+
+
+@attrs
+class Profiler:
+    """Records calls to methods, keyed by (owner ID, method name), where owner
+    is the object which defines the method. If sink is not None, it is called
+    after every call with (owner ID, method name, total, own, exception),
+    where exception is None unless the method raised one. Changes are made
+    while holding lock, which a thread-safe Database replaces with a real
+    lock."""
+
+    sink = attrib(default=Factory(type(None)))
+    lock = attrib(default=Factory(nullcontext), repr=False, eq=False)
+    methods = attrib(default=Factory(dict), init=False, repr=False)
+    resolution_misses = attrib(default=Factory(int), init=False)
+    local = attrib(default=Factory(local), init=False, repr=False, eq=False)
+
+    def wrap(self, bound, owner, name):
+        """Return bound, a bound method found under the given name on Object
+        instance owner, wrapped so its calls are recorded."""
+        key = (owner.id, name)
+        with self.lock:
+            stats = self.methods.get(key, None)
+            if stats is None:
+                stats = MethodStats()
+                self.methods[key] = stats
+        if iscoroutinefunction(bound.__func__):
+            cls = AsyncProfiledMethod
+        else:
+            cls = ProfiledMethod
+        return cls(bound, key, stats, self)
+
+    def record(self, method, total, own, exception):
+        """Record a call to ProfiledMethod instance method."""
+        stats = method.stats
+        with self.lock:
+            stats.calls += 1
+            stats.total += total
+            stats.own += own
+            if exception is not None:
+                stats.exceptions += 1
+        if self.sink is not None:
+            self.sink(method.key[0], method.key[1], total, own, exception)
+
+    def stats(self):
+        """Return a dictionary of the statistics recorded so far."""
+        with self.lock:
+            return dict(
+                resolution_misses=self.resolution_misses, methods={
+                    key: dict(
+                        calls=stats.calls, total=stats.total, own=stats.own,
+                        exceptions=stats.exceptions
+                    ) for key, stats in self.methods.items() if stats.calls
+                }
+            )
@@ -1,25 +1,73 @@
-"""Provides the Property class."""
+"""Provides the Property and CompactProperty classes."""
 
-from attr import attrs, attrib
+from attr import attrs, attrib, Factory
+from .exc import ReadOnlyError
+from .references import UnresolvedValue
+from .transactions import restore_value
 
 NoneType = type(None)
 
 
-@attrs
-class Property:
-    """A property on an Object instance."""
+class BaseProperty:
+    """The behaviour shared by Property and CompactProperty."""
 
-    name = attrib()
-    description = attrib()
-    type = attrib()
-    value = attrib()
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        owner = getattr(self, 'owner', None)
+        if name == 'value' and owner is not None:
+            if owner.database.read_only:
+                raise ReadOnlyError(owner.database)
+            old = self.value
+            super().__setattr__(name, value)
+            owner.database.update_references(owner, self.name, old, value)
+            owner.database.mark_dirty(
+                owner, 'set', name=self.name, value=value
+            )
+            if owner.database.undo_log is not None:
+                owner.database.record_undo(
+                    owner, restore_value, owner, self.name, old
+                )
+        else:
+            super().__setattr__(name, value)
 
     def get(self):
-        return self.value
+        value = self.value
+        if value.__class__ is UnresolvedValue:
+            value = self.owner.database.load_value(value.value)
+            # Resolving a value does not change it, so don't record it.
+            object.__setattr__(self, 'value', value)
+        return value
 
     def set(self, value):
-        if not isinstance(value, (NoneType, self.type)):
+        if (
+            value is not None and value.__class__ is not self.type and
+            not isinstance(value, self.type)
+        ):
             raise TypeError(
                 'Type mismatch for property %r. Value: %r.' % (self, value)
             )
         self.value = value
+
+
+@attrs
+class Property(BaseProperty):
+    """A property on an Object instance."""
+
+    name = attrib()
+    description = attrib()
+    type = attrib()
+    value = attrib()
+    owner = attrib(default=Factory(NoneType), repr=False, eq=False)
+
+
+@attrs(slots=True)
+class CompactProperty(BaseProperty):
+    """A Property without a __dict__, which uses much less memory. Use it by
+    passing property_class=CompactProperty to Database."""
+
+    name = attrib()
+    description = attrib()
+    type = attrib()
+    value = attrib()
+    owner = attrib(default=Factory(NoneType), repr=False, eq=False)
@@ -1,11 +1,80 @@
-"""Provides the PropertyTypes class."""
+"""Provides the PropertyTypes class, and the default property_types."""
 
 from datetime import datetime, timedelta
 
 NoneType = type(None)
 
 
-property_types = dict(
+class PropertyTypes(dict):
+    """A dictionary of name: class pairs, which also keeps the reverse mapping
+    of class: name, so types can be looked up either way in constant time.
+    The reverse mapping is rebuilt after the dictionary is modified. If more
+    than one name refers to the same class, the last name wins."""
+
+    __slots__ = ('_names',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._names = None
+
+    @property
+    def names(self):
+        """A dictionary of class: name pairs."""
+        if self._names is None:
+            self._names = {cls: name for name, cls in self.items()}
+        return self._names
+
+    def name_of(self, cls):
+        """Return the name of class cls, or None if it is not a valid type."""
+        return self.names.get(cls, None)
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        self._names = None
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self._names = None
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._names = None
+        return value
+
+    def popitem(self):
+        value = super().popitem()
+        self._names = None
+        return value
+
+    def setdefault(self, name, default=None):
+        value = super().setdefault(name, default)
+        self._names = None
+        return value
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._names = None
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        result = self.copy()
+        result.update(other)
+        return result
+
+    def clear(self):
+        super().clear()
+        self._names = None
+
+    def copy(self):
+        return type(self)(self)
+
+
+property_types = PropertyTypes(
     null=NoneType,
     bool=bool,
     str=str,
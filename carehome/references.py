@@ -0,0 +1,20 @@
+"""Provides the ObjectReference and UnresolvedValue classes."""
+
+from attr import attrs, attrib
+
+
+@attrs(slots=True)
+class ObjectReference:
+    """A reference to an object. used when dumping and loading properties."""
+
+    id = attrib()
+
+
+@attrs(slots=True)
+class UnresolvedValue:
+    """A property value, as loaded by a Storage instance, which contains
+    ObjectReference instances. The property's value is replaced with the
+    loaded value the first time it is read, so the objects it refers to are
+    only loaded when they are needed."""
+
+    value = attrib()
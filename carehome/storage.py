@@ -0,0 +1,615 @@
+"""Provides storage backends for databases."""
+
+import json
+import mmap
+import sqlite3
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+from weakref import WeakValueDictionary
+from attr import attrs, attrib, Factory
+from .binary import BinaryReader
+from .exc import ReadOnlyError
+from .references import UnresolvedValue
+
+schema = """
+create table if not exists objects (
+    id integer primary key, location integer
+);
+create table if not exists parents (
+    id integer, position integer, parent integer
+);
+create index if not exists parents_id on parents (id);
+create index if not exists parents_parent on parents (parent);
+create table if not exists properties (
+    id integer, name text, type text, description text, value text
+);
+create index if not exists properties_id on properties (id);
+create table if not exists methods (id integer, name text, code text);
+create index if not exists methods_id on methods (id);
+create table if not exists refs (holder integer, name text, target integer);
+create index if not exists refs_holder on refs (holder);
+create table if not exists registered (name text primary key, id integer);
+create table if not exists meta (key text primary key, value integer);
+"""
+
+
+@attrs(eq=False)
+class Storage(MutableMapping):
+    """The base class for storage backends. Pass an instance as the storage
+    argument to the Database constructor, and it will be used as
+    Database.objects.
+
+    Objects are loaded the first time they are accessed, and up to cache_size
+    of the most recently used objects are kept in memory. Changed objects are
+    passed to write_object when they are evicted. Evicted objects which are
+    still referenced elsewhere are reused when they are next accessed, so
+    there is never more than one instance of any object.
+
+    Subclasses must provide fetch, child_ids, exists, write_object, __iter__
+    and __len__."""
+
+    cache_size = attrib(default=Factory(lambda: 10000), kw_only=True)
+    database = attrib(default=Factory(type(None)), init=False, repr=False)
+    cache = attrib(default=Factory(OrderedDict), init=False, repr=False)
+    loaded = attrib(
+        default=Factory(WeakValueDictionary), init=False, repr=False
+    )
+    detached = attrib(
+        default=Factory(WeakValueDictionary), init=False, repr=False
+    )
+    dirty = attrib(default=Factory(dict), init=False, repr=False)
+    deleted = attrib(default=Factory(set), init=False, repr=False)
+    pending = attrib(default=Factory(dict), init=False, repr=False)
+    loading = attrib(default=Factory(bool), init=False, repr=False)
+
+    def bind(self, database):
+        """Bind this storage to a Database instance."""
+        self.database = database
+
+    def fetch(self, id):
+        """Return a dictionary, as returned by Database.dump_object, for the
+        object with the given ID, or raise KeyError."""
+        raise NotImplementedError()
+
+    def child_ids(self, id):
+        """Return the IDs of the children of the object with the given ID."""
+        raise NotImplementedError()
+
+    def exists(self, id):
+        """Return whether or not an object with the given ID has been
+        stored."""
+        raise NotImplementedError()
+
+    def write_object(self, obj):
+        """Store Object instance obj."""
+        raise NotImplementedError()
+
+    def __getitem__(self, id):
+        if id in self.deleted:
+            raise KeyError(id)
+        if id in self.cache:
+            self.cache.move_to_end(id)
+            return self.cache[id]
+        obj = self.loaded.get(id, None)
+        if obj is None:
+            obj = self.load_object(id)
+        elif id not in self.pending:
+            if self.detached.pop(id, None) is not None:
+                obj.forget_resolution(hierarchy=True)
+            self.link_object(obj)
+            self.cache_object(obj)
+        return obj
+
+    def __setitem__(self, id, obj):
+        self.deleted.discard(id)
+        self.loaded[id] = obj
+        self.dirty[id] = obj
+        self.cache_object(obj)
+
+    def __delitem__(self, id):
+        obj = self[id]
+        self.cache.pop(id, None)
+        self.dirty.pop(id, None)
+        self.detached.pop(id, None)
+        del self.loaded[id]
+        self.deleted.add(id)
+        return obj
+
+    def __contains__(self, id):
+        if id in self.deleted:
+            return False
+        elif id in self.loaded:
+            return True
+        return self.exists(id)
+
+    def cache_object(self, obj):
+        """Add Object instance obj to the cache of recently-used objects,
+        evicting the least recently used objects if the cache is full."""
+        self.cache[obj.id] = obj
+        self.cache.move_to_end(obj.id)
+        while len(self.cache) > self.cache_size:
+            id, old = self.cache.popitem(last=False)
+            self.evict_object(old)
+
+    def evict_object(self, obj):
+        """Write Object instance obj back if it has changed, or if it has a
+        list or a dictionary as a property value, and detach it from its
+        parents' lists of children, so it can be garbage collected if nothing
+        else refers to it. Until then, it is kept in self.detached, so that
+        Object.invalidate_resolution can still reach it."""
+        containers = self.database.containers
+        if obj.id in self.dirty or not self.database.read_only and any(
+            (obj.id, name) in containers for name in obj._properties
+        ):
+            self.dirty.pop(obj.id, None)
+            self.write_object(obj)
+        for parent in obj._parents:
+            if any(child is obj for child in parent._children):
+                parent._children.remove(obj)
+                parent._children_loaded = False
+        self.detached[obj.id] = obj
+        obj.forget_resolution(hierarchy=True)
+
+    def link_object(self, obj):
+        """Make sure Object instance obj is in the lists of children of all
+        its parents."""
+        for parent in obj._parents:
+            if not any(child is obj for child in parent._children):
+                parent._children.append(obj)
+
+    def touch(self, obj):
+        """Note that Object instance obj has changed and must be written back.
+        """
+        self.dirty[obj.id] = obj
+        self.cache_object(obj)
+
+    def load_object(self, id):
+        """Load and return the object with the given ID. Events are not fired,
+        and nothing is marked as changed. The parents of the object are
+        loaded too. They are queued in self.pending rather than being loaded
+        recursively, so long chains of objects cannot exhaust the stack.
+        Objects in property values are only loaded when those values are
+        first read, as described by UnresolvedValue."""
+        if self.loading:
+            return self.create_object(id)
+        self.loading = True
+        try:
+            obj = self.create_object(id)
+            while self.pending:
+                self.hydrate_object(*self.pending.popitem()[1])
+        except BaseException:
+            for other, d in self.pending.values():
+                self.loaded.pop(other.id, None)
+            self.pending.clear()
+            raise
+        finally:
+            self.loading = False
+        return obj
+
+    def create_object(self, id):
+        """Create and return the object with the given ID, with its methods
+        but without its parents or properties, and add it to self.pending to
+        be finished by hydrate_object."""
+        d = self.fetch(id)
+        database = self.database
+        obj = database.object_class(database, id=id)
+        obj._location = d['location']
+        obj._children_loaded = False
+        for data in d['methods']:
+            obj._methods[data['name']] = database.method_class(
+                database, data['code'], name=data['name']
+            )
+        self.loaded[id] = obj
+        self.pending[id] = (obj, d)
+        return obj
+
+    def hydrate_object(self, obj, d):
+        """Give Object instance obj, as returned by create_object, the
+        properties and parents from a dictionary d, and add it to the
+        cache."""
+        database = self.database
+        for data in d['properties']:
+            value = data['value']
+            if isinstance(value, (list, dict)):
+                database.containers.add((obj.id, data['name']))
+            if database.find_references(value):
+                value = UnresolvedValue(value)
+            p = database.property_class(
+                data['name'], data['description'],
+                database.property_types[data['type']], value
+            )
+            obj._properties[p.name] = p
+            p.owner = obj
+        for parent in d['parents']:
+            obj._parents.append(self[parent])
+        self.link_object(obj)
+        self.cache_object(obj)
+
+    def load_children(self, obj):
+        """Make sure all the children of Object instance obj are loaded."""
+        obj._children[:] = [self[id] for id in self.child_ids(obj.id)]
+        obj._children_loaded = True
+
+
+@attrs(eq=False)
+class SQLiteStorage(Storage):
+    """Stores objects in an SQLite database. Changed objects are written back
+    when they are evicted, and whenever flush is called."""
+
+    filename = attrib()
+    connection = attrib(default=Factory(type(None)), init=False, repr=False)
+
+    def bind(self, database):
+        """Bind this storage to a Database instance. The database's max_id,
+        registered objects and indices are loaded."""
+        super().bind(database)
+        self.connection = sqlite3.connect(self.filename)
+        self.connection.executescript(schema)
+        c = self.connection.execute(
+            'select value from meta where key = ?', ('max_id',)
+        )
+        row = c.fetchone()
+        if row is not None:
+            database.max_id = row[0]
+        for id, location in self.connection.execute(
+            'select id, location from objects where location is not null'
+        ):
+            database.locations.setdefault(location, set()).add(id)
+        for holder, name, target in self.connection.execute(
+            'select holder, name, target from refs'
+        ):
+            database.references.setdefault(target, set()).add((holder, name))
+        for name, id in self.connection.execute(
+            'select name, id from registered'
+        ).fetchall():
+            database.registered_objects[name] = self[id]
+
+    def __iter__(self):
+        self.flush()
+        for row in self.connection.execute(
+            'select id from objects order by id'
+        ).fetchall():
+            yield row[0]
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute(
+            'select count(*) from objects'
+        ).fetchone()[0]
+
+    def exists(self, id):
+        return self.connection.execute(
+            'select 1 from objects where id = ?', (id,)
+        ).fetchone() is not None
+
+    def fetch(self, id):
+        c = self.connection
+        row = c.execute(
+            'select location from objects where id = ?', (id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(id)
+        database = self.database
+        methods = [
+            dict(name=name, code=code) for name, code in c.execute(
+                'select name, code from methods where id = ?', (id,)
+            ).fetchall()
+        ]
+        properties = [
+            dict(
+                name=name, type=type, description=description,
+                value=database.decode_json_value(json.loads(value))
+            ) for name, type, description, value in c.execute(
+                'select name, type, description, value from properties where '
+                'id = ?', (id,)
+            ).fetchall()
+        ]
+        parents = [
+            row[0] for row in c.execute(
+                'select parent from parents where id = ? order by position',
+                (id,)
+            ).fetchall()
+        ]
+        return dict(
+            id=id, location=row[0], methods=methods, properties=properties,
+            parents=parents
+        )
+
+    def child_ids(self, id):
+        self.write_changes()
+        return [
+            row[0] for row in self.connection.execute(
+                'select id from parents where parent = ? order by id', (id,)
+            ).fetchall()
+        ]
+
+    def write_object(self, obj):
+        """Write Object instance obj to the SQLite database."""
+        database = self.database
+        c = self.connection
+        id = obj.id
+        for table, column in (
+            ('parents', 'id'), ('properties', 'id'), ('methods', 'id'),
+            ('refs', 'holder')
+        ):
+            c.execute('delete from %s where %s = ?' % (table, column), (id,))
+        c.execute(
+            'insert or replace into objects (id, location) values (?, ?)',
+            (id, obj._location)
+        )
+        c.executemany(
+            'insert into parents (id, position, parent) values (?, ?, ?)', [
+                (id, position, parent.id) for position, parent in
+                enumerate(obj._parents)
+            ]
+        )
+        c.executemany(
+            'insert into methods (id, name, code) values (?, ?, ?)', [
+                (id, m.name, m.code) for m in obj._methods.values()
+            ]
+        )
+        for name, p in obj._properties.items():
+            if not isinstance(p, database.property_class):
+                continue
+            d = database.dump_property(p)
+            c.execute(
+                'insert into properties (id, name, type, description, value) '
+                'values (?, ?, ?, ?, ?)', (
+                    id, name, d['type'], d['description'],
+                    json.dumps(database.encode_json_value(d['value']))
+                )
+            )
+            c.executemany(
+                'insert into refs (holder, name, target) values (?, ?, ?)', [
+                    (id, name, target) for target in
+                    database.find_references(p.value)
+                ]
+            )
+
+    def write_changes(self):
+        """Write all changed objects to the SQLite database, and remove all
+        deleted ones, without committing."""
+        c = self.connection
+        for obj in self.dirty.values():
+            self.write_object(obj)
+        self.dirty.clear()
+        for id in self.deleted:
+            for table, column in (
+                ('objects', 'id'), ('parents', 'id'), ('properties', 'id'),
+                ('methods', 'id'), ('refs', 'holder')
+            ):
+                c.execute(
+                    'delete from %s where %s = ?' % (table, column), (id,)
+                )
+        self.deleted.clear()
+
+    def flush(self):
+        """Write all changed objects, the database's max_id and its registered
+        objects to the SQLite database, and commit."""
+        self.database.mark_containers_dirty()
+        self.write_changes()
+        c = self.connection
+        c.execute(
+            'insert or replace into meta (key, value) values (?, ?)',
+            ('max_id', self.database.max_id)
+        )
+        c.execute('delete from registered')
+        c.executemany(
+            'insert into registered (name, id) values (?, ?)', [
+                (name, obj.id) for name, obj in
+                self.database.registered_objects.items()
+            ]
+        )
+        c.commit()
+
+    def close(self):
+        """Flush and close the SQLite database."""
+        self.flush()
+        self.connection.close()
+
+
+@attrs(eq=False)
+class SnapshotLocations(Mapping):
+    """A read-only replacement for Database.locations, which reads contents
+    from a snapshot."""
+
+    reader = attrib()
+
+    def __getitem__(self, id):
+        ids = set(self.reader.contents_of(id))
+        if not ids:
+            raise KeyError(id)
+        return ids
+
+    def __iter__(self):
+        return self.reader.locations()
+
+    def __len__(self):
+        return len(list(self.reader.locations()))
+
+    def __delitem__(self, id):
+        raise ReadOnlyError(self)
+
+    def setdefault(self, id, default=None):
+        raise ReadOnlyError(self)
+
+
+@attrs(eq=False)
+class SnapshotStorage(Storage):
+    """Reads objects from a binary snapshot, as written by
+    Database.save_binary, which is mapped into memory. Only the objects which
+    are accessed are decoded, so binding loads just the registered objects
+    and their ancestors, and processes which open the same snapshot share
+    its pages. Objects cannot be created, destroyed or changed."""
+
+    filename = attrib()
+    file = attrib(default=Factory(type(None)), init=False, repr=False)
+    map = attrib(default=Factory(type(None)), init=False, repr=False)
+    reader = attrib(default=Factory(type(None)), init=False, repr=False)
+
+    def bind(self, database):
+        """Bind this storage to a Database instance, and open the snapshot."""
+        super().bind(database)
+        self.file = open(self.filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.reader = BinaryReader(database, self.map)
+        database.read_only = True
+        database.max_id = self.reader.max_id
+        database.journal_sequence = self.reader.journal_sequence
+        database.locations = SnapshotLocations(self.reader)
+        for name, id in self.reader.registered_objects.items():
+            database.registered_objects[name] = self[id]
+
+    def __iter__(self):
+        return self.reader.ids()
+
+    def __len__(self):
+        return self.reader.count()
+
+    def __setitem__(self, id, obj):
+        raise ReadOnlyError(self)
+
+    def __delitem__(self, id):
+        raise ReadOnlyError(self)
+
+    def touch(self, obj):
+        raise ReadOnlyError(self, obj)
+
+    def exists(self, id):
+        return self.reader.lookup(id) is not None
+
+    def fetch(self, id):
+        result = self.reader.lookup(id)
+        if result is None:
+            raise KeyError(id)
+        return self.reader.read_object(result[0])[0]
+
+    def child_ids(self, id):
+        return self.reader.children_of(id)
+
+    def close(self):
+        """Close the snapshot. Objects which have not been accessed yet can
+        no longer be loaded."""
+        self.reader = None
+        self.map.close()
+        self.file.close()
+
+
+@attrs(eq=False)
+class OverlayMapping(MutableMapping):
+    """A replacement for Database.locations or Database.references, which
+    reads through to the same mapping on another database. Sets of IDs are
+    copied the first time they are accessed, so the parent mapping is never
+    changed."""
+
+    parent = attrib()
+    own = attrib(default=Factory(dict), init=False, repr=False)
+    removed = attrib(default=Factory(set), init=False, repr=False)
+
+    def __getitem__(self, key):
+        if key in self.own:
+            return self.own[key]
+        elif key in self.removed or key not in self.parent:
+            raise KeyError(key)
+        value = set(self.parent[key])
+        self.own[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.removed.discard(key)
+        self.own[key] = value
+
+    def __delitem__(self, key):
+        self[key]
+        del self.own[key]
+        self.removed.add(key)
+
+    def __iter__(self):
+        yield from list(self.own)
+        for key in list(self.parent):
+            if key not in self.own and key not in self.removed:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+
+@attrs(eq=False)
+class ForkStorage(Storage):
+    """Reads objects through from another database, as returned by
+    Database.fork. Objects are copied from the parent database the first
+    time they are accessed, so changing them never changes the parent, and
+    untouched objects cost nothing. Changed objects which are evicted are
+    kept as dictionaries, and compiled method code is shared with the
+    parent. The parent should not be changed while the fork is in use."""
+
+    parent = attrib()
+    written = attrib(default=Factory(dict), init=False, repr=False)
+
+    def bind(self, database):
+        """Bind this storage to a Database instance, which shares the parent
+        database's max_id, indices, registered objects and code cache."""
+        super().bind(database)
+        parent = self.parent
+        database.code_cache = parent.code_cache
+        for name, value in database.method_globals.items():
+            if value is parent:
+                database.method_globals[name] = database
+            elif value is parent.objects:
+                database.method_globals[name] = database.objects
+        database.max_id = parent.max_id
+        database.journal_sequence = parent.journal_sequence
+        database.locations = OverlayMapping(parent.locations)
+        database.references = OverlayMapping(parent.references)
+        for name, obj in parent.registered_objects.items():
+            database.registered_objects[name] = self[obj.id]
+
+    def __iter__(self):
+        ids = set(self.parent.objects)
+        ids.update(self.written)
+        ids.update(self.loaded.keys())
+        return iter(sorted(ids.difference(self.deleted)))
+
+    def __len__(self):
+        return sum(1 for id in self)
+
+    def __delitem__(self, id):
+        obj = super().__delitem__(id)
+        self.written.pop(id, None)
+        return obj
+
+    def exists(self, id):
+        return id in self.written or id in self.parent.objects
+
+    def fetch(self, id):
+        if id in self.written:
+            return self.written[id]
+        parent = self.parent
+        return parent.dump_object(parent.objects[id])
+
+    def parent_ids(self, id):
+        """Return the IDs of the parents of the object with the given ID, as
+        seen by this fork."""
+        obj = self.loaded.get(id, None)
+        if obj is not None:
+            return [parent.id for parent in obj._parents]
+        elif id in self.written:
+            return self.written[id]['parents']
+        return [parent.id for parent in self.parent.objects[id]._parents]
+
+    def child_ids(self, id):
+        ids = set(self.written)
+        ids.update(self.loaded.keys())
+        if id in self.parent.objects:
+            ids.update(
+                child.id for child in self.parent.objects[id].children
+            )
+        return [
+            child for child in sorted(ids.difference(self.deleted))
+            if id in self.parent_ids(child)
+        ]
+
+    def write_object(self, obj):
+        """Keep a dictionary of Object instance obj, to be loaded again if it
+        is next accessed."""
+        self.written[obj.id] = self.database.dump_object(obj)
@@ -0,0 +1,46 @@
+"""Functions used to undo changes when a transaction is rolled back. See
+Database.transaction."""
+
+
+def restore_value(obj, name, value):
+    """Set the property with the given name on Object instance obj back to
+    value."""
+    obj._properties[name].value = value
+
+
+def restore_location(obj, id):
+    """Move Object instance obj back to the object with the given ID, or
+    nowhere if id is None."""
+    obj.location = None if id is None else obj.database.objects[id]
+
+
+def restore_method(obj, name, method):
+    """Put Method instance method back on Object instance obj under the given
+    name, or remove the method with that name if method is None."""
+    if method is None:
+        obj.remove_method(name)
+    else:
+        obj.add_method(method.code, name=name)
+
+
+def restore_object(obj):
+    """Put an Object instance obj which was destroyed back into its
+    database."""
+    obj.database.destroyed.pop(obj.id, None)
+    obj.database.store_object(obj)
+
+
+def forget_object(obj):
+    """Remove Object instance obj, which was created during the transaction,
+    from its database."""
+    obj.database.remove_object(obj)
+    obj.database.destroyed.pop(obj.id, None)
+
+
+def restore_registration(database, name, obj):
+    """Register Object instance obj under the given name, or unregister the
+    name if obj is None."""
+    if obj is None:
+        database.unregister_object(name)
+    else:
+        database.register_object(name, obj)
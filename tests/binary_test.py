@@ -0,0 +1,59 @@
+"""Test binary snapshots."""
+
+from datetime import datetime, timedelta, timezone
+from pytest import raises
+from carehome import Database
+from carehome.binary import (
+    encode_varint, encode_signed, decode_varint, decode_signed
+)
+from carehome.exc import SnapshotError
+
+
+def test_varints():
+    for number in (0, 1, 127, 128, 300, 2 ** 70):
+        buffer = bytearray()
+        encode_varint(number, buffer)
+        assert decode_varint(buffer, 0) == (number, len(buffer))
+    for number in (0, -1, 1, -64, 64, -(2 ** 70)):
+        buffer = bytearray()
+        encode_signed(number, buffer)
+        assert decode_signed(buffer, 0) == (number, len(buffer))
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'world.snapshot')
+    d = Database()
+    room = d.create_object()
+    thing = d.create_object()
+    thing.add_method('def describe(self):\n    return self.name')
+    sword = d.create_object(thing)
+    sword.location = room
+    sword.name = 'Sword'
+    sword.weight = 2.5
+    sword.damage = -4
+    sword.sharp = True
+    sword.made = datetime(1900, 1, 2, 3, 4, 5, 6)
+    sword.made_here = datetime.now(timezone.utc)
+    sword.lasts = timedelta(days=3, seconds=-1)
+    sword.nothing = None
+    sword.stuff = {1: [room, thing], 'test': {'nested': 'value'}}
+    room.contains = sword
+    d.register_object('room', room)
+    d.save_binary(filename)
+    new = Database()
+    new.load_binary(filename)
+    assert new.dump() == d.dump()
+    assert new.max_id == d.max_id
+    new_sword = new.objects[sword.id]
+    assert new_sword.describe() == 'Sword'
+    assert new_sword.location is new.room
+    assert new.room.contains is new_sword
+
+
+def test_invalid(tmp_path):
+    filename = str(tmp_path / 'invalid.snapshot')
+    with open(filename, 'wb') as f:
+        f.write(b'Not a snapshot at all, not even close.')
+    d = Database()
+    with raises(SnapshotError):
+        d.load_binary(filename)
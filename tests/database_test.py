@@ -1,13 +1,17 @@
 """Test Database objects."""
 
+import io
 import re
+from threading import Thread
+from time import sleep
 from datetime import datetime
 from types import FunctionType
 from pytest import raises
 from carehome import Database, Object, Property, Method, ObjectReference
+from carehome.property_types import PropertyTypes
 from carehome.exc import (
     LoadPropertyError, LoadMethodError, LoadObjectError, ObjectRegisteredError,
-    HasChildrenError, HasContentsError, IsValueError
+    HasChildrenError, HasContentsError, IsValueError, DestroyingError
 )
 
 
@@ -405,13 +409,13 @@ def test_clear_func_cache():
     child.add_method('def test2(self):\n    return 2')
     child.add_parent(parent)
     parent.test1()
-    assert len(parent._method_cache) == 1
+    assert len(d.bindings) == 1
     child.test1()
     child.test2()
-    assert len(child._method_cache) == 2
+    assert len(d.bindings) == 3
     d.clear_method_cache()
-    assert not parent._method_cache
-    assert not child._method_cache
+    assert not d.bindings.entries
+    assert not d.bindings.names
 
 
 def test_create_object_with_parents():
@@ -424,6 +428,32 @@ def test_create_object_with_parents():
     assert child.parents == [parent_1, parent_2]
 
 
+def test_property_types_registry():
+    d = Database(property_types=dict(str=str, int=int))
+    assert isinstance(d.property_types, PropertyTypes)
+    assert d.property_types.name_of(int) == 'int'
+    assert d.property_types.name_of(d.object_class) == 'obj'
+    assert d.property_types.name_of(float) is None
+    o = d.create_object()
+    with raises(TypeError):
+        o.add_property('weight', float, 1.5)
+    d.property_types['number'] = float
+    assert d.property_types.name_of(float) == 'number'
+    p = o.add_property('weight', float, 1.5)
+    assert d.dump_property(p)['type'] == 'number'
+    del d.property_types['number']
+    with raises(RuntimeError):
+        d.dump_property(p)
+    types = d.property_types
+    types |= dict(number=float)
+    assert types is d.property_types
+    assert types.name_of(float) == 'number'
+    combined = types | dict(real=float)
+    assert isinstance(combined, PropertyTypes)
+    assert combined.name_of(float) == 'real'
+    assert types.name_of(float) == 'number'
+
+
 def test_property_types():
     d = Database()
     assert d.property_types['obj'] is Object
@@ -440,3 +470,326 @@ def test_dump_property_custom_object():
     p = o.add_property('this', d.object_class, o)
     value = d.dump_property(p)
     assert value['type'] == 'obj'
+
+
+def test_load_location_index():
+    d = Database()
+    room = d.create_object()
+    thing = d.create_object()
+    thing.location = room
+    new = Database()
+    new.load(d.dump())
+    assert new.objects[room.id].contents == [new.objects[thing.id]]
+    assert new.locations == {room.id: {thing.id}}
+
+
+def test_referrers():
+    d = Database()
+    o1 = d.create_object()
+    o2 = d.create_object()
+    o3 = d.create_object()
+    assert d.referrers(o2) == []
+    p1 = o1.add_property('friend', d.object_class, o2)
+    assert d.referrers(o2) == [(o1, p1)]
+    p3 = o3.add_property('friends', list, [o1, o2])
+    assert d.referrers(o2) == [(o1, p1), (o3, p3)]
+    assert d.referrers(o1) == [(o3, p3)]
+    o3.friends = [o1]
+    assert d.referrers(o2) == [(o1, p1)]
+    o1.friend = None
+    assert d.referrers(o2) == []
+    o1.friend = o2
+    o1.remove_property('friend')
+    assert d.referrers(o2) == []
+    assert p1.owner is None
+    p3.value.append(o2)
+    assert d.referrers(o2) == [(o3, p3)]
+    with raises(IsValueError):
+        d.destroy_object(o2)
+    d.rebuild_references()
+    assert d.referrers(o2) == [(o3, p3)]
+    o3.friends = None
+    d.destroy_object(o2)
+    d.destroy_object(o3)
+    assert d.references == {}
+
+
+def test_load_referrers():
+    d = Database()
+    o1 = d.create_object()
+    o2 = d.create_object()
+    o1.add_property('friend', d.object_class, o2)
+    new = Database()
+    new.load(d.dump())
+    holder = new.objects[o1.id]
+    assert new.referrers(new.objects[o2.id]) == [
+        (holder, holder._properties['friend'])
+    ]
+
+
+def test_dump_load_stream():
+    d = Database()
+    child = d.create_object()
+    parent = d.create_object()
+    child.add_parent(parent)
+    child.location = parent
+    now = datetime.utcnow()
+    child.add_property(
+        'stuff', dict, {1: [parent, child], 'when': now, 'how_long': None}
+    )
+    parent.add_property('child', d.object_class, child)
+    parent.add_method('def test(self):\n    return self')
+    d.register_object('parent', parent)
+    f = io.StringIO()
+    d.dump_stream(f)
+    lines = f.getvalue().splitlines()
+    assert len(lines) == 3
+    f.seek(0)
+    new = Database()
+    new.load_stream(f)
+    new_parent = new.parent
+    new_child = new.objects[child.id]
+    assert new_parent.id == parent.id
+    assert new_child.parents == [new_parent]
+    assert new_child.location is new_parent
+    assert new_child.stuff == {
+        1: [new_parent, new_child], 'when': now, 'how_long': None
+    }
+    assert new_parent.child is new_child
+    assert new_child.test() is new_child
+
+
+def test_load_stream_missing():
+    d = Database()
+    o = d.create_object()
+    other = d.create_object()
+    o.add_property('other', d.object_class, other)
+    f = io.StringIO()
+    d.dump_stream(f)
+    lines = f.getvalue().splitlines()
+    del lines[1]
+    new = Database()
+    with raises(LoadObjectError):
+        new.load_stream(lines)
+
+
+def test_dirty():
+    d = Database()
+    o = d.create_object()
+    assert d.dirty == {o.id}
+    d.checkpoint()
+    assert not d.dirty
+    o.name = 'test'
+    assert d.dirty == {o.id}
+    d.checkpoint()
+    o.name = 'other'
+    assert d.dirty == {o.id}
+    d.checkpoint()
+    o.location = d.create_object()
+    assert d.dirty == {o.id, o.location.id}
+    d.checkpoint()
+    o.add_method('def test(self):\n    pass')
+    assert d.dirty == {o.id}
+    d.destroy_object(o)
+    assert not d.dirty
+    assert list(d.destroyed) == [o.id]
+
+
+def test_dump_apply_delta():
+    d = Database()
+    parent = d.create_object()
+    unchanged = d.create_object()
+    changed = d.create_object(parent)
+    doomed = d.create_object()
+    changed.name = 'changed'
+    d.register_object('parent', parent)
+    new = Database()
+    new.load(d.dump())
+    assert not new.dirty
+    d.checkpoint()
+    d.destroy_object(doomed)
+    created = d.create_object(changed)
+    created.location = parent
+    changed.name = 'still changed'
+    changed.friend = created
+    changed.remove_parent(parent)
+    changed.add_method('def test(self):\n    return self.name')
+    delta = d.dump_delta()
+    assert not d.dirty
+    assert not d.destroyed
+    assert [data['id'] for data in delta['objects']] == [
+        changed.id, created.id
+    ]
+    assert delta['destroyed'] == [doomed.id]
+    new.apply_delta(delta)
+    assert new.dump() == d.dump()
+    assert new.max_id == d.max_id
+    assert unchanged.id in new.objects
+    assert new.objects[changed.id].test() == 'still changed'
+    assert new.objects[created.id].location is new.parent
+
+
+def test_delta_containers():
+    d = Database()
+    holder = d.create_object()
+    holder.inventory = []
+    holder.stats = {}
+    other = d.create_object()
+    other.name = 'other'
+    new = Database()
+    new.load(d.dump())
+    d.checkpoint()
+    holder.inventory.append(other)
+    holder.stats['hp'] = 5
+    delta = d.dump_delta()
+    assert [data['id'] for data in delta['objects']] == [holder.id]
+    new.apply_delta(delta)
+    assert new.objects[holder.id].inventory == [new.objects[other.id]]
+    assert new.objects[holder.id].stats == {'hp': 5}
+    holder.inventory = None
+    holder.stats = None
+    d.checkpoint()
+    assert d.dump_delta()['objects'] == []
+
+
+def test_apply_delta_events():
+    d = Database()
+    base = d.create_object()
+    thing = d.create_object(base)
+    thing.hp = 5
+    thing.name = 'Thing'
+    thing.add_method('def describe(self):\n    return self.name')
+    new = Database()
+    new.load(d.dump())
+    new_base = new.objects[base.id]
+    for name in (
+        'on_add_property', 'on_remove_property', 'on_attach', 'on_init',
+        'on_add_parent', 'on_remove_parent', 'on_add_child'
+    ):
+        new_base.add_method(
+            'def %s(self, *args):\n    raise RuntimeError(%r)' % (name, name)
+        )
+    d.checkpoint()
+    hp = new.objects[thing.id]._properties['hp']
+    thing.hp = 6
+    thing.remove_property('name')
+    thing.add_method('def describe(self):\n    return "changed"')
+    d.create_object(base)
+    new.apply_delta(d.dump_delta())
+    changed = new.objects[thing.id]
+    assert changed._properties['hp'] is hp
+    assert changed.hp == 6
+    assert 'name' not in changed._properties
+    assert changed.describe() == 'changed'
+    assert len(new_base.children) == 2
+
+
+def test_threadsafe():
+    d = Database()
+    assert d.stripes is None
+    d = Database(threadsafe=True)
+    assert d.stripes is not None
+    base = d.create_object()
+    base.hp = 5
+    rooms = [d.create_object(base) for x in range(4)]
+    created = []
+    errors = []
+
+    def work(n):
+        try:
+            for x in range(200):
+                o = d.create_object(base)
+                created.append(o.id)
+                o.location = rooms[(n + x) % len(rooms)]
+                o.hp = x
+                assert o.hp == x
+                rooms[x % len(rooms)].contents
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=work, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(set(created)) == 800
+    assert len(base.children) == 804
+    assert sum(room.contents_count for room in rooms) == 800
+    for room in rooms:
+        for obj in room.contents:
+            assert obj.location is room
+
+
+def test_threadsafe_move():
+    d = Database(threadsafe=True)
+    rooms = [d.create_object() for x in range(3)]
+    things = [d.create_object() for x in range(5)]
+    locked = d.locked
+    errors = []
+
+    def slow_locked(*ids):
+        sleep(0.001)
+        return locked(*ids)
+
+    d.locked = slow_locked
+
+    def work(n):
+        try:
+            for x in range(50):
+                for thing in things:
+                    thing.location = rooms[(n + x) % len(rooms)]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=work, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    for thing in things:
+        holders = [
+            room for room in rooms if thing.id in d.locations.get(room.id, ())
+        ]
+        assert holders == [thing.location]
+
+
+def test_threadsafe_destroy():
+    d = Database(threadsafe=True)
+    room = d.create_object()
+    thing = d.create_object()
+    thing.location = room
+    with raises(HasContentsError):
+        d.remove_object(room)
+    assert d.objects[room.id] is room
+    child = d.create_object(room)
+    thing.location = None
+    with raises(HasChildrenError):
+        d.remove_object(room)
+    assert child.parents == [room]
+
+
+def test_destroying():
+    d = Database()
+    parent = d.create_object()
+    room = d.create_object(parent)
+    thing = d.create_object()
+    room.add_property('thing', Object, thing)
+    room.errors = []
+    room.add_method(
+        'def on_remove_parent(self, child, parent):\n'
+        '    for func in (\n'
+        '        lambda: setattr(self.thing, "location", self),\n'
+        '        lambda: database.create_object(self)\n'
+        '    ):\n'
+        '        try:\n'
+        '            func()\n'
+        '        except Exception as e:\n'
+        '            self.errors.append(e)'
+    )
+    d.destroy_object(room)
+    assert [type(e) for e in room.errors] == [DestroyingError] * 2
+    assert thing.location is None
+    assert not d.destroying
+    assert room.id not in d.objects
@@ -1,5 +1,6 @@
 """Test the events framework."""
 
+import asyncio
 from attr import attrs, attrib
 from pytest import raises
 from carehome import Database, methods
@@ -179,3 +180,181 @@ def test_on_remove_property():
     assert stuff.args[0] is o
     assert stuff.args[1] == name
     assert stuff.kwargs == {}
+
+
+def test_handler_cache():
+    d = Database()
+    parent = d.create_object()
+    o = d.create_object(parent)
+    assert o.get_handler('on_test') is None
+    assert o._handlers['on_test'] is None
+    parent.add_method('def on_test(self):\n    return self')
+    assert o._handlers is None
+    assert o.try_event('on_test') is o
+    assert o._handlers['on_test'].__self__ is o
+    o.add_method('def on_test(self):\n    return 1234')
+    assert o.try_event('on_test') == 1234
+    o.remove_method('on_test')
+    o.remove_parent(parent)
+    assert o.try_event('on_test') is None
+
+
+def test_event_counts():
+    d = Database()
+    o = d.create_object()
+    assert d.event_counts['on_init'] == 0
+    assert d.event_misses['on_init'] == 1
+    o.add_method('def on_test(self):\n    pass')
+    o.try_event('on_test')
+    o.do_event('on_test')
+    assert d.event_counts['on_test'] == 2
+
+
+def test_batch_events():
+    d = Database()
+    room = d.create_object()
+    room.add_method(
+        'def on_enter(self, obj, thing):\n'
+        '    self.log = self.log + [thing.id]'
+    )
+    room.log = []
+    things = [d.create_object() for x in range(3)]
+    with d.batch_events():
+        for thing in things:
+            thing.location = room
+        with d.batch_events():
+            d.attach_object(things[0])
+        assert room.log == []
+        assert len(d.event_queue) == 4
+    assert d.event_queue is None
+    assert room.log == [thing.id for thing in things]
+
+
+def test_batch_events_coalesce():
+    d = Database()
+    o = d.create_object()
+    o.count = 0
+    o.add_method('def on_attach(self, obj):\n    self.count += 1')
+    with d.batch_events():
+        d.attach_object(o)
+        d.attach_object(o)
+    assert o.count == 1
+
+
+def test_batch_events_enter_exit_enter():
+    d = Database()
+    room = d.create_object()
+    room.add_method(
+        'def on_enter(self, obj, thing):\n'
+        '    self.log = self.log + ["enter"]'
+    )
+    room.add_method(
+        'def on_exit(self, obj, thing):\n'
+        '    self.log = self.log + ["exit"]'
+    )
+    room.log = []
+    thing = d.create_object()
+    with d.batch_events():
+        thing.location = room
+        thing.location = None
+        thing.location = room
+    assert thing.location is room
+    assert room.log == ['enter', 'exit', 'enter']
+
+
+def test_batch_events_batched_handler():
+    d = Database()
+    room = d.create_object()
+    room.add_method(
+        'def on_enter(self, events):\n'
+        '    self.batches = self.batches + [len(events)]\n'
+        'on_enter.batched = True'
+    )
+    room.batches = []
+    with d.batch_events():
+        for x in range(3):
+            d.create_object().location = room
+    assert room.batches == [3]
+    d.create_object().location = room
+    assert room.batches == [3, 1]
+
+
+def test_coroutine_method():
+    d = Database()
+    o = d.create_object()
+    m = o.add_method('async def on_event(self, value):\n    return value * 2')
+    assert m.coroutine is True
+    assert o.add_method('def on_sync(self):\n    return 1').coroutine is False
+    assert asyncio.run(o.ado_event('on_event', 4)) == 8
+    assert asyncio.run(o.ado_event('on_sync')) == 1
+    assert asyncio.run(o.atry_event('on_missing')) is None
+    with raises(NoSuchEventError):
+        asyncio.run(o.ado_event('on_missing'))
+
+
+def test_async_create_destroy():
+    d = Database()
+    parent = d.create_object()
+    parent.add_method(
+        'import asyncio\n'
+        'async def on_init(self, obj):\n'
+        '    await asyncio.sleep(0)\n'
+        '    obj.log = obj.log + ["init"]'
+    )
+    parent.add_method('def on_attach(self, obj):\n    obj.log = ["attach"]')
+    parent.add_method(
+        'async def on_destroy(self, obj):\n'
+        '    obj.log = obj.log + ["destroy"]'
+    )
+
+    async def run():
+        o = await d.acreate_object(parent)
+        assert o.log == ['attach', 'init']
+        await d.adestroy_object(o)
+        return o
+
+    o = asyncio.run(run())
+    assert o.id not in d.objects
+    assert o.log == ['attach', 'init', 'destroy']
+
+
+def test_async_parents():
+    d = Database()
+    events = []
+    d.method_globals['events'] = events
+    base = d.create_object()
+    parent = d.create_object()
+    for obj, name in ((base, 'on_add_parent'), (base, 'on_remove_parent')):
+        obj.add_method(
+            'import asyncio\n'
+            'async def %s(self, child, parent):\n'
+            '    await asyncio.sleep(0)\n'
+            '    events.append(("%s", child.id, parent.id))' % (name, name)
+        )
+    for obj, name in ((parent, 'on_add_child'), (parent, 'on_remove_child')):
+        obj.add_method(
+            'import asyncio\n'
+            'async def %s(self, parent, child):\n'
+            '    await asyncio.sleep(0)\n'
+            '    events.append(("%s", parent.id, child.id))' % (name, name)
+        )
+
+    async def run():
+        o = await d.acreate_object(base, parent)
+        assert o.parents == [base, parent]
+        await o.aremove_parent(base)
+        await o.aadd_parent(base)
+        await d.adestroy_object(o)
+        return o
+
+    o = asyncio.run(run())
+    assert o.id not in d.objects
+    assert parent.children == []
+    assert events == [
+        ('on_add_parent', o.id, parent.id),
+        ('on_add_child', parent.id, o.id),
+        ('on_remove_parent', o.id, base.id),
+        ('on_remove_parent', o.id, parent.id),
+        ('on_remove_child', parent.id, o.id),
+        ('on_remove_parent', o.id, base.id)
+    ]
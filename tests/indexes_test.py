@@ -0,0 +1,141 @@
+"""Test indexes and queries."""
+
+from datetime import datetime, timezone
+from carehome import Database, Index, Range
+
+
+def make_world():
+    d = Database()
+    monster = d.create_object()
+    monster.zone = 'town'
+    monster.hp = 20
+    orc = d.create_object(monster)
+    orc.zone = 'forest'
+    orc.hp = 5
+    goblin = d.create_object(monster)
+    goblin.zone = 'forest'
+    goblin.hp = 15
+    rat = d.create_object(monster)
+    rat.hp = 1
+    rock = d.create_object()
+    rock.zone = 'forest'
+    return (d, monster, orc, goblin, rat, rock)
+
+
+def test_range():
+    r = Range(low=5, high=10)
+    assert r.matches(5)
+    assert r.matches(9.5)
+    assert not r.matches(10)
+    assert not r.matches(4)
+    assert not r.matches('5')
+    assert Range(high=10, high_inclusive=True).matches(10)
+    assert not Range(low=5, low_inclusive=False).matches(5)
+
+
+def test_index():
+    i = Index('hp', sorted=True)
+    i.set(1, 5)
+    i.set(2, 10)
+    i.set(3, 'test')
+    i.set(4, [1, 2])
+    assert i.equal(5) == {1}
+    assert i.equal([1, 2]) is None
+    assert i.range(Range(low=5)) == {1, 2}
+    assert i.range(Range(low='a')) == {3}
+    i.set(1, 20)
+    assert i.equal(5) == set()
+    assert i.range(Range(high=10, high_inclusive=True)) == {2}
+    i.discard(2)
+    assert i.range(Range()) is None
+    assert i.range(Range(low=0)) == {1}
+    assert Index('hp').range(Range(low=0)) is None
+
+
+def test_query_unindexed():
+    d, monster, orc, goblin, rat, rock = make_world()
+    assert d.query(zone='forest') == [orc, goblin, rock]
+    assert d.query(zone='forest', isa=monster) == [orc, goblin]
+    assert d.query(hp=Range(high=10)) == [orc, rat]
+    assert d.query(zone='town') == [monster, rat]
+    assert d.query(colour='red') == []
+
+
+def test_query_indexed():
+    d, monster, orc, goblin, rat, rock = make_world()
+    d.add_index('zone')
+    d.add_index('hp', sorted=True)
+    assert d.query(zone='forest') == [orc, goblin, rock]
+    assert d.query(zone='forest', isa=monster) == [orc, goblin]
+    assert d.query(hp=Range(high=10)) == [orc, rat]
+    assert d.query(zone='town') == [monster, rat]
+    monster.zone = 'swamp'
+    assert d.query(zone='swamp') == [monster, rat]
+    orc.hp = 50
+    assert d.query(hp=Range(high=10)) == [rat]
+    rat.remove_parent(monster)
+    assert d.query(zone='swamp') == [monster]
+    rat.add_parent(goblin)
+    assert d.query(zone='forest') == [orc, goblin, rat, rock]
+    goblin.remove_property('zone')
+    assert d.query(zone='swamp') == [monster, goblin, rat]
+    baby = d.create_object(orc)
+    assert d.query(hp=50) == [orc, baby]
+    d.destroy_object(baby)
+    assert d.query(hp=50) == [orc]
+    d.remove_index('hp')
+    assert d.query(hp=50) == [orc]
+
+
+def test_query_location():
+    d, monster, orc, goblin, rat, rock = make_world()
+    room = d.create_object()
+    orc.location = room
+    rock.location = room
+    d.add_index('zone')
+    assert d.query(location=room) == [orc, rock]
+    assert d.query(location=room, isa=monster) == [orc]
+    assert d.query(location=room, zone='town') == []
+
+
+def test_query_dates():
+    d = Database()
+    d.add_index('when', sorted=True)
+    first = d.create_object()
+    first.when = datetime(2018, 1, 1)
+    second = d.create_object()
+    second.when = datetime(2019, 1, 1)
+    assert d.query(when=Range(low=datetime(2018, 6, 1))) == [second]
+
+
+def test_query_nan():
+    d = Database()
+    d.add_index('weight', sorted=True)
+    first, second, third = (d.create_object() for x in range(3))
+    first.weight = 3.0
+    second.weight = 1.0
+    third.weight = 2.0
+    first.weight = float('nan')
+    assert d.query(weight=Range(high=5)) == [second, third]
+    assert d.query(weight=Range(low=0)) == [second, third]
+    first.weight = 4.0
+    assert d.query(weight=Range(high=5)) == [first, second, third]
+    d.remove_index('weight')
+    first.weight = float('nan')
+    assert d.query(weight=Range(high=5)) == [second, third]
+    assert not Range(low=0).matches(float('nan'))
+
+
+def test_query_timezones():
+    d = Database()
+    d.add_index('when', sorted=True)
+    naive = d.create_object()
+    naive.when = datetime(2018, 1, 1)
+    aware = d.create_object()
+    aware.when = datetime(2019, 1, 1, tzinfo=timezone.utc)
+    assert d.query(when=Range(low=datetime(2017, 1, 1))) == [naive]
+    assert d.query(
+        when=Range(low=datetime(2017, 1, 1, tzinfo=timezone.utc))
+    ) == [aware]
+    naive.when = datetime(2018, 6, 1)
+    assert d.query(when=datetime(2018, 6, 1)) == [naive]
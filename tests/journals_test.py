@@ -0,0 +1,71 @@
+"""Test journals."""
+
+import os.path
+from carehome import Database, Journal
+
+
+def make_database(tmp_path):
+    snapshot = str(tmp_path / 'snapshot.jsonl')
+    journal = str(tmp_path / 'journal.jsonl')
+    d = Database()
+    d.recover(snapshot, journal)
+    return (d, snapshot, journal)
+
+
+def test_write(tmp_path):
+    filename = str(tmp_path / 'journal.jsonl')
+    j = Journal(filename, sync_every=2)
+    j.write(dict(op='test'))
+    assert j.pending == 1
+    j.write(dict(op='test'))
+    assert j.pending == 0
+    j.close()
+    assert list(Journal.read(filename)) == [dict(op='test')] * 2
+    with open(filename, 'a') as f:
+        f.write('{"op": "tor')
+    assert len(list(Journal.read(filename))) == 2
+
+
+def test_recover(tmp_path):
+    d, snapshot, journal = make_database(tmp_path)
+    room = d.create_object()
+    d.register_object('room', room)
+    thing = d.create_object(room)
+    thing.location = room
+    thing.add_property('friends', list, [room])
+    thing.friends = [room, room]
+    thing.add_method('def test(self):\n    return self.friends')
+    doomed = d.create_object()
+    d.destroy_object(doomed)
+    d.journal.sync()
+    new, snapshot, journal = make_database(tmp_path)
+    assert new.dump() == d.dump()
+    new_thing = new.objects[thing.id]
+    assert new_thing.test() == [new.room, new.room]
+    assert new_thing.location is new.room
+    assert doomed.id not in new.objects
+
+
+def test_compact(tmp_path):
+    d, snapshot, journal = make_database(tmp_path)
+    o = d.create_object()
+    o.name = 'first'
+    d.compact(snapshot)
+    assert os.path.isfile(snapshot)
+    assert list(Journal.read(journal)) == []
+    o.name = 'second'
+    d.journal.sync()
+    new, snapshot, journal = make_database(tmp_path)
+    assert new.objects[o.id].name == 'second'
+    assert new.journal_sequence == d.journal_sequence
+
+
+def test_compact_crash(tmp_path):
+    d, snapshot, journal = make_database(tmp_path)
+    o = d.create_object()
+    o.name = 'test'
+    d.journal.sync()
+    with open(snapshot, 'w') as f:
+        d.dump_stream(f)
+    new, snapshot, journal = make_database(tmp_path)
+    assert new.dump() == d.dump()
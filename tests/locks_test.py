@@ -0,0 +1,26 @@
+"""Test lock stripes."""
+
+from threading import Thread
+from carehome.locks import LockStripes
+
+
+def test_stripes():
+    s = LockStripes(count=4)
+    assert len(s.locks) == 4
+    assert s.stripes(5, 1, None, 2, 6) == [1, 2]
+    assert s.stripes() == []
+
+
+def test_hold():
+    s = LockStripes(count=4)
+    with s.hold(1, 2):
+        with s.hold(2, 5):
+            assert s.locks[1]._is_owned()
+            assert s.locks[2]._is_owned()
+        results = []
+        t = Thread(target=lambda: results.append(s.locks[1].acquire(False)))
+        t.start()
+        t.join()
+        assert results == [False]
+    assert not s.locks[1]._is_owned()
+    assert not s.locks[2]._is_owned()
@@ -5,10 +5,11 @@ import os.path
 import re
 from inspect import isclass, isfunction
 from types import FunctionType
-import flake8
+import pycodestyle
+from pyflakes.checker import Checker
 from pytest import raises
 from carehome import Method, Database, methods
-from carehome.exc import Flake8NotFound
+from carehome.methods import validate_source
 
 db = Database()
 inserted_global = object()
@@ -105,13 +106,8 @@ def test_no_func():
         Method(db, 'import sys')
 
 
-def test_flake8():
-    assert methods.flake8 is flake8
+def test_validate_code():
     m = Method(db, 'def f():\n    pass\n')
-    methods.flake8 = None
-    with raises(Flake8NotFound):
-        m.validate_code()
-    methods.flake8 = flake8
     assert m.validate_code() is None
     m = Method(db, 'def f():\n    return something\n', name='f')
     with raises(NameError):
@@ -122,3 +118,70 @@ def test_flake8():
     db.method_globals['pretend'] = 1234
     m = Method(db, 'def f():\n    return pretend\n', name='f')
     assert m.validate_code() is None
+
+
+def test_validate_source_style():
+    res = validate_source('def f():\n  x=1\n  return 1')
+    lines = res.splitlines()
+    assert 'stdin:2:3: E111 indentation is not a multiple of 4' in lines
+    assert 'stdin:2:4: E225 missing whitespace around operator' in lines
+    assert 'stdin:3:11: W292 no newline at end of file' in lines
+    assert "stdin:2:3: F841 local variable 'x' is assigned to but never " \
+        'used' in lines
+
+
+def test_validate_source_fallback():
+    assert methods.Checker is not None
+    assert methods.pycodestyle is not None
+    methods.Checker = None
+    methods.pycodestyle = None
+    try:
+        assert validate_source('def f():\n    return something\n') is None
+        assert validate_source('def f():\n  return 1') is None
+        res = validate_source('def f(:\n    pass\n')
+    finally:
+        methods.Checker = Checker
+        methods.pycodestyle = pycodestyle
+    assert res.startswith('stdin:1:')
+    assert ' E999 SyntaxError: ' in res
+
+
+def test_validate_all_methods():
+    d = Database()
+    good = 'def f(self):\n    return 1\n'
+    bad = 'def g(self):\n    return missing\n'
+    objects = [d.create_object() for x in range(3)]
+    for obj in objects:
+        obj.add_method(good)
+    objects[1].add_method(bad)
+    objects[2].add_method(bad)
+    expected = {
+        (objects[1].id, 'g'): validate_source(bad),
+        (objects[2].id, 'g'): validate_source(bad)
+    }
+    assert d.validate_all_methods(processes=1) == expected
+    assert d.validate_all_methods(processes=2) == expected
+
+
+def test_code_cache():
+    db = Database()
+    source = 'def f():\n    return 1234'
+    m1 = Method(db, source)
+    m2 = Method(db, source)
+    assert m1.get_filename() == m2.get_filename()
+    assert m1.func is not m2.func
+    assert m1.func.__code__ is m2.func.__code__
+    assert db.code_cache[m1.get_digest()] is m1.get_code_object()
+    m3 = Method(db, 'def f():\n    return 5678')
+    assert m3.get_filename() != m1.get_filename()
+
+
+def test_bytecode_cache():
+    db = Database(bytecode_cache=True)
+    m = Method(db, 'def cached():\n    return "cached"')
+    filename = os.path.splitext(m.get_filename())[0] + '.marshal'
+    assert os.path.isfile(filename)
+    db = Database(bytecode_cache=True)
+    m = Method(db, m.code)
+    assert m.func() == 'cached'
+    assert m.func.__code__.co_filename == m.get_filename()
@@ -2,9 +2,14 @@
 
 from datetime import datetime
 from types import MethodType, FunctionType
+from attr import fields
 from pytest import raises
-from carehome import Object, Property, Database, Method
+from carehome import (
+    Object, Property, Database, Method, BindingCache, CompactObject,
+    CompactProperty
+)
 from carehome.exc import DuplicateParentError, ParentIsChildError
+from carehome.objects import reserved_attributes
 
 db = Database()
 
@@ -253,14 +258,39 @@ def test_get_method():
 
 
 def test_method_cache():
-    o = db.create_object()
-    m = o.add_method('def test(self):\n    return 1')
+    d = Database(bindings=BindingCache(size=2))
+    o = d.create_object()
+    o.add_method('def test(self):\n    return 1')
     assert o.test() == 1
-    assert o._method_cache == {id(m.func): o.test}
+    assert d.bindings.entries == {(o.id, 'test'): o.test}
+    assert d.bindings.hits == 1
+    assert d.bindings.misses == 1
     o.remove_method('test')
-    m = o.add_method('def test(self):\n    return 2')
+    assert not d.bindings.entries
+    o.add_method('def test(self):\n    return 2')
     assert o.test() == 2
-    assert o._method_cache[id(m.func)] is o.test
+    assert d.bindings.entries[(o.id, 'test')] is o.test
+
+
+def test_method_cache_eviction():
+    d = Database(bindings=BindingCache(size=2))
+    parent = d.create_object()
+    parent.add_method('def test(self):\n    return self.id')
+    children = [d.create_object(parent) for x in range(3)]
+    for child in children:
+        assert child.test() == child.id
+    assert len(d.bindings) == 2
+    assert d.bindings.evictions == 1
+    assert list(d.bindings.entries) == [
+        (children[1].id, 'test'), (children[2].id, 'test')
+    ]
+    assert d.bindings.names == {
+        children[1].id: {'test'}, children[2].id: {'test'}
+    }
+    other = d.create_object()
+    other.add_method('def test(self):\n    return None')
+    children[2].add_parent(other)
+    assert list(d.bindings.entries) == [(children[1].id, 'test')]
 
 
 def test_location():
@@ -295,6 +325,60 @@ def test_location_custom_object():
     assert loc.contents == [obj]
 
 
+def test_compact_object():
+    db = Database(object_class=CompactObject, property_class=CompactProperty)
+    parent = db.create_object()
+    parent.name = 'Parent'
+    parent.add_method('def describe(self):\n    return self.name')
+    child = db.create_object(parent)
+    assert not hasattr(child, '__dict__')
+    assert child.describe() == 'Parent'
+    child.name = 'Child'
+    assert isinstance(child._properties['name'], CompactProperty)
+    assert child.describe() == 'Child'
+    assert parent.name == 'Parent'
+    child.location = parent
+    assert parent.contents == [child]
+    with raises(RuntimeError):
+        child.id = 5
+    d = Database(object_class=CompactObject, property_class=CompactProperty)
+    d.load(db.dump())
+    assert d.objects[child.id].describe() == 'Child'
+    assert d.objects[child.id].location is d.objects[parent.id]
+
+
+def test_reserved_attributes():
+    names = reserved_attributes(Object)
+    assert names is reserved_attributes(Object)
+    for name in ('location', 'add_parent', '_parents', 'id', '_mro'):
+        assert name in names
+    assert 'name' not in names
+    assert '_parents' in reserved_attributes(CompactObject)
+
+
+def test_compact_attributes():
+    def describe(cls):
+        return [(a.name, a.init, a.repr, a.eq) for a in fields(cls)]
+
+    assert describe(CompactObject) == describe(Object)
+    assert not hasattr(CompactObject(db), '__dict__')
+
+
+def test_setattr_inherited_property():
+    db = Database()
+    parent = db.create_object()
+    parent.add_property('hp', int, 5, description='Hit points.')
+    child = db.create_object(parent)
+    child.hp = 3
+    p = child._properties['hp']
+    assert p.type is int
+    assert p.description == 'Hit points.'
+    child.hp = 4
+    assert child._properties['hp'] is p
+    assert p.value == 4
+    assert parent.hp == 5
+
+
 def test_find_property():
     db = Database()
     parent = db.create_object()
@@ -328,3 +412,95 @@ def test_property_dynamic_add():
     assert p.value == value
     assert p.description == 'Added by __setattr__.'
     assert p.type is str
+
+
+def test_resolution_order():
+    db = Database()
+    grandparent = db.create_object()
+    parent_1 = db.create_object(grandparent)
+    parent_2 = db.create_object(grandparent)
+    o = db.create_object(parent_1, parent_2)
+    assert o.resolution_order() == (o, parent_1, parent_2, grandparent)
+    grandparent.name = 'grandparent'
+    parent_2.name = 'parent 2'
+    assert o.name == 'parent 2'
+    assert o.resolve('name') == (parent_2, parent_2._properties['name'])
+    assert o.resolve('nothing') is None
+
+
+def test_resolution_invalidation():
+    db = Database()
+    grandparent = db.create_object()
+    parent = db.create_object(grandparent)
+    o = db.create_object(parent)
+    grandparent.add_property('test', str, 'grandparent')
+    assert o.test == 'grandparent'
+    parent.add_property('test', str, 'parent')
+    assert o.test == 'parent'
+    parent.add_method('def test(self):\n    return self')
+    assert o.test() is o
+    parent.remove_method('test')
+    assert o.test == 'parent'
+    parent.remove_property('test')
+    assert o.test == 'grandparent'
+    o.remove_parent(parent)
+    with raises(AttributeError):
+        print(o.test)
+    o.add_parent(grandparent)
+    assert o.test == 'grandparent'
+    o._properties['test'] = 'direct'
+    assert o.test == 'direct'
+
+
+def test_contents_index():
+    db = Database()
+    room = db.create_object()
+    assert room.contents_count == 0
+    assert not room.has_contents
+    things = [db.create_object() for x in range(3)]
+    for thing in things:
+        thing.location = room
+    assert room.contents == things
+    assert room.contents_count == 3
+    assert room.has_contents
+    assert db.locations == {room.id: {thing.id for thing in things}}
+    things[0].location = None
+    assert room.contents == things[1:]
+    db.destroy_object(things[1])
+    assert room.contents == things[2:]
+    things[2].location = None
+    assert not room.has_contents
+    assert db.locations == {}
+
+
+def test_isa():
+    db = Database()
+    weapon = db.create_object()
+    sword = db.create_object(weapon)
+    magic = db.create_object()
+    magic_sword = db.create_object(sword, magic)
+    assert magic_sword.isa(magic_sword)
+    assert magic_sword.isa(sword)
+    assert magic_sword.isa(weapon)
+    assert magic_sword.isa(magic)
+    assert not weapon.isa(sword)
+    assert not sword.isa(magic)
+    magic.add_parent(weapon)
+    assert magic.isa(weapon)
+    magic_sword.remove_parent(sword)
+    assert not magic_sword.isa(sword)
+    assert magic_sword.isa(weapon)
+    with raises(ParentIsChildError):
+        weapon.add_parent(magic_sword)
+    with raises(DuplicateParentError):
+        magic_sword.add_parent(weapon)
+
+
+def test_diamond_deduplicated():
+    db = Database()
+    grandparent = db.create_object()
+    parent_1 = db.create_object(grandparent)
+    parent_2 = db.create_object(grandparent)
+    child = db.create_object(parent_1, parent_2)
+    assert list(child.ancestors()) == [parent_1, grandparent, parent_2]
+    assert list(grandparent.descendants()) == [parent_1, child, parent_2]
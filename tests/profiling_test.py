@@ -0,0 +1,115 @@
+"""Test profiling."""
+
+from asyncio import run
+from types import MethodType
+from pytest import raises
+from carehome import Database
+from carehome.profiling import Profiler, ProfiledMethod
+
+
+def make_world(d):
+    base = d.create_object()
+    base.add_method('def outer(self):\n    return self.inner()')
+    base.add_method(
+        'def inner(self):\n    import time\n    time.sleep(0.01)\n    return 5'
+    )
+    base.add_method('def fail(self):\n    raise ValueError()')
+    return (base, d.create_object(base))
+
+
+def test_disabled():
+    d = Database()
+    base, o = make_world(d)
+    assert d.profiler is None
+    assert type(o.outer) is MethodType
+    assert 'methods' not in d.stats()
+
+
+def test_methods():
+    d = Database()
+    base, o = make_world(d)
+    assert o.inner() == 5
+    profiler = d.start_profiling()
+    assert isinstance(profiler, Profiler)
+    assert d.profiler is profiler
+    assert isinstance(o.outer, ProfiledMethod)
+    assert o.outer() == 5
+    assert o.outer() == 5
+    with raises(ValueError):
+        o.fail()
+    methods = d.stats()['methods']
+    outer = methods[(base.id, 'outer')]
+    inner = methods[(base.id, 'inner')]
+    assert outer['calls'] == 2
+    assert inner['calls'] == 2
+    assert outer['total'] >= inner['total'] >= 0.02
+    assert outer['own'] < 0.01
+    assert inner['own'] == inner['total']
+    assert methods[(base.id, 'fail')]['calls'] == 1
+    assert methods[(base.id, 'fail')]['exceptions'] == 1
+    assert d.stop_profiling() is profiler
+    assert d.profiler is None
+    assert type(o.outer) is MethodType
+    o.outer()
+    assert profiler.methods[(base.id, 'outer')].calls == 2
+
+
+def test_sink():
+    d = Database()
+    base, o = make_world(d)
+    calls = []
+    d.start_profiling(
+        sink=lambda *args: calls.append((args[0], args[1], args[4]))
+    )
+    o.outer()
+    with raises(ValueError):
+        o.fail()
+    assert calls[:2] == [(base.id, 'inner', None), (base.id, 'outer', None)]
+    assert calls[2][:2] == (base.id, 'fail')
+    assert isinstance(calls[2][2], ValueError)
+
+
+def test_events():
+    d = Database()
+    room = d.create_object()
+    room.add_method('def on_enter(self, room, thing):\n    self.entered = 1')
+    thing = d.create_object()
+    thing.location = room
+    d.start_profiling()
+    thing.location = None
+    thing.location = room
+    stats = d.stats()
+    assert stats['methods'][(room.id, 'on_enter')]['calls'] == 1
+    assert stats['events']['on_enter'] == 2
+    assert stats['event_misses']['on_exit'] == 1
+    assert stats['event_dispatches'] == sum(stats['events'].values())
+
+
+def test_async():
+    d = Database()
+    o = d.create_object()
+    o.add_method(
+        'async def test(self):\n    import asyncio\n'
+        '    await asyncio.sleep(0.01)\n    return 3'
+    )
+    d.start_profiling()
+    assert run(o.test()) == 3
+    stats = d.profiler.methods[(o.id, 'test')]
+    assert stats.calls == 1
+    assert stats.own == stats.total >= 0.01
+
+
+def test_counters():
+    d = Database()
+    base, o = make_world(d)
+    d.start_profiling()
+    o.outer
+    o.outer
+    stats = d.stats()
+    assert stats['resolution_misses'] == 1
+    assert stats['binding_hits'] == 1
+    assert stats['binding_misses'] == 1
+    base.add_method('def other(self):\n    return 1')
+    o.other
+    o.other
+    assert d.stats()['resolution_misses'] == 2
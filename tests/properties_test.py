@@ -2,7 +2,7 @@
 
 from datetime import datetime
 from pytest import raises
-from carehome import Property
+from carehome import Property, CompactProperty
 
 name = 'test'
 
@@ -37,3 +37,12 @@ def test_set():
     assert p.value is value
     p.set(None)
     assert p.value is None
+
+
+def test_compact():
+    p = CompactProperty(name, 'Test property.', str, 'Test')
+    assert not hasattr(p, '__dict__')
+    p.set('Other')
+    assert p.get() == 'Other'
+    with raises(TypeError):
+        p.set(1)
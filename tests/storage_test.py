@@ -0,0 +1,335 @@
+"""Test storage backends."""
+
+from datetime import datetime
+from gc import collect
+from pytest import raises
+from carehome import (
+    Database, SQLiteStorage, SnapshotStorage, ForkStorage, ObjectReference
+)
+from carehome.exc import ReadOnlyError, IsValueError
+
+
+def open_database(tmp_path, cache_size=10000):
+    storage = SQLiteStorage(str(tmp_path / 'world.db'), cache_size=cache_size)
+    return Database(storage=storage)
+
+
+def test_round_trip(tmp_path):
+    d = open_database(tmp_path)
+    assert d.objects is d.storage
+    thing = d.create_object()
+    thing.add_method('def describe(self):\n    return self.name')
+    room = d.create_object()
+    sword = d.create_object(thing)
+    sword.name = 'Sword'
+    sword.location = room
+    now = datetime.utcnow()
+    sword.made = now
+    room.owner = sword
+    d.register_object('room', room)
+    d.storage.close()
+    d = open_database(tmp_path)
+    assert d.max_id == 3
+    assert len(d.objects) == 3
+    assert list(d.objects) == [thing.id, room.id, sword.id]
+    assert d.locations == {room.id: {sword.id}}
+    assert d.references == {sword.id: {(room.id, 'owner')}}
+    room = d.room
+    assert d.storage.loaded.get(sword.id) is None
+    assert d.storage.loaded.get(thing.id) is None
+    sword = room.owner
+    assert d.storage.loaded.get(thing.id) is not None
+    assert sword is d.objects[sword.id]
+    assert sword.describe() == 'Sword'
+    assert sword.made == now
+    assert room.contents == [sword]
+    thing = sword.parents[0]
+    assert thing.children == [sword]
+    assert not d.dirty
+
+
+def test_lazy_children(tmp_path):
+    d = open_database(tmp_path)
+    parent = d.create_object()
+    children = [d.create_object(parent) for x in range(5)]
+    d.storage.close()
+    d = open_database(tmp_path)
+    parent = d.objects[parent.id]
+    assert not parent._children
+    assert [child.id for child in parent.children] == [
+        child.id for child in children
+    ]
+
+
+def test_eviction(tmp_path):
+    d = open_database(tmp_path, cache_size=2)
+    objects = [d.create_object() for x in range(5)]
+    assert len(d.storage.cache) == 2
+    objects[0].name = 'first'
+    objects[1].name = 'second'
+    objects[2].name = 'third'
+    assert objects[0].id not in d.storage.dirty
+    assert objects[0].id not in d.storage.cache
+    assert d.objects[objects[0].id] is objects[0]
+    del objects
+    d.storage.close()
+    d = open_database(tmp_path, cache_size=2)
+    assert d.objects[0].name == 'first'
+    assert d.objects[1].name == 'second'
+
+
+def test_destroy(tmp_path):
+    d = open_database(tmp_path)
+    parent = d.create_object()
+    child = d.create_object(parent)
+    d.storage.flush()
+    d.destroy_object(child)
+    assert child.id not in d.objects
+    assert parent.children == []
+    d.destroy_object(parent)
+    d.storage.close()
+    d = open_database(tmp_path)
+    assert len(d.objects) == 0
+    assert d.max_id == 2
+
+
+def test_snapshot(tmp_path):
+    filename = str(tmp_path / 'world.snapshot')
+    d = Database()
+    thing = d.create_object()
+    thing.add_method('def describe(self):\n    return self.name')
+    room = d.create_object()
+    sword = d.create_object(thing)
+    sword.name = 'Sword'
+    sword.location = room
+    shield = d.create_object(thing)
+    shield.location = room
+    room.owner = sword
+    d.register_object('room', room)
+    d.save_binary(filename)
+    storage = SnapshotStorage(filename)
+    replica = Database(storage=storage)
+    assert replica.max_id == d.max_id
+    assert list(replica.objects) == [thing.id, room.id, sword.id, shield.id]
+    assert len(replica.objects) == 4
+    assert sword.id in replica.objects
+    assert 99 not in replica.objects
+    assert list(storage.loaded) == [room.id]
+    room = replica.room
+    assert not storage.loaded.get(shield.id)
+    sword = room.owner
+    assert sorted(storage.loaded) == [thing.id, room.id, sword.id]
+    assert sword.describe() == 'Sword'
+    assert [x.id for x in room.contents] == [sword.id, shield.id]
+    assert room.contents_count == 2
+    assert sword.parents[0].children == [sword, replica.objects[shield.id]]
+    assert replica.read_only
+    before = replica.dump()
+    max_id = replica.max_id
+    for func in (
+        lambda: setattr(sword, 'name', 'Something else'),
+        lambda: setattr(sword, 'hp', 5),
+        lambda: sword.add_method('def test(self):\n    pass'),
+        lambda: sword.remove_method('describe'),
+        lambda: sword.remove_property('name'),
+        lambda: sword.add_parent(room),
+        lambda: sword.remove_parent(sword.parents[0]),
+        lambda: setattr(sword, 'location', None),
+        lambda: setattr(sword, 'location', replica.objects[thing.id]),
+        lambda: replica.create_object(),
+        lambda: replica.destroy_object(replica.objects[shield.id]),
+        lambda: replica.register_object('sword', sword),
+        lambda: replica.unregister_object('room')
+    ):
+        with raises(ReadOnlyError):
+            func()
+    assert replica.dump() == before
+    assert replica.max_id == max_id
+    assert sword.name == 'Sword'
+    assert 'test' not in sword._methods
+    assert [x.id for x in room.contents] == [sword.id, shield.id]
+    storage.close()
+
+
+def test_fork():
+    d = Database()
+    base = d.create_object()
+    base.add_method('def describe(self):\n    return self.name')
+    room = d.create_object()
+    thing = d.create_object(base)
+    thing.name = 'Thing'
+    thing.location = room
+    thing.friends = [room]
+    d.register_object('room', room)
+    d.checkpoint()
+    before = d.dump()
+    compiled = len(d.code_cache)
+    f = d.fork()
+    assert isinstance(f.storage, ForkStorage)
+    assert f.code_cache is d.code_cache
+    assert f.method_globals['database'] is f
+    assert not f.storage.loaded.get(thing.id)
+    assert list(f.objects) == [base.id, room.id, thing.id]
+    assert f.room is not room
+    assert f.room.id == room.id
+    t = f.objects[thing.id]
+    assert t is not thing
+    assert t.describe() == 'Thing'
+    assert f.room.contents == [t]
+    assert t.friends == [f.room]
+    assert f.objects[base.id].children == [t]
+    t.name = 'Changed'
+    t.friends.append(t)
+    t.location = None
+    other = f.create_object(f.objects[base.id])
+    other.location = f.room
+    assert f.room.contents == [other]
+    assert room.contents == [thing]
+    assert len(d.code_cache) == compiled
+    assert d.dump() == before
+    assert not d.dirty
+    assert thing.name == 'Thing'
+    d.merge(f)
+    assert thing.name == 'Changed'
+    assert thing.location is None
+    assert room.contents == [d.objects[other.id]]
+    assert base.children == [thing, d.objects[other.id]]
+    assert d.dump() == f.dump()
+
+
+def test_merge_dirty():
+    d = Database()
+    a, b, c, room = (d.create_object() for x in range(4))
+    a.hp = 0
+    b.hp = 0
+    d.checkpoint()
+    a.hp = 1
+    f = d.fork()
+    f.objects[b.id].hp = 2
+    f.objects[c.id].location = f.objects[room.id]
+    d.merge(f)
+    assert b.hp == 2
+    assert c.location is room
+    delta = d.dump_delta()
+    assert [data['id'] for data in delta['objects']] == [a.id, b.id, c.id]
+    assert not d.dirty
+
+
+def test_fork_eviction(tmp_path):
+    d = open_database(tmp_path)
+    objects = [d.create_object() for x in range(5)]
+    d.storage.close()
+    d = open_database(tmp_path)
+    f = d.fork(cache_size=2)
+    for obj in f.objects.values():
+        obj.name = 'Object %d' % obj.id
+    assert len(f.storage.cache) == 2
+    f.destroy_object(f.objects[objects[0].id])
+    assert objects[0].id not in f.objects
+    assert objects[0].id in d.objects
+    assert len(f.objects) == 4
+    assert f.objects[1].name == 'Object 1'
+    assert not d.dirty
+    d.merge(f)
+    assert objects[0].id not in d.objects
+    assert [obj.name for obj in d.objects.values()] == [
+        'Object %d' % id for id in range(1, 5)
+    ]
+
+
+def test_container_referrers(tmp_path):
+    d = open_database(tmp_path)
+    holder = d.create_object()
+    holder.inventory = []
+    thing = d.create_object()
+    d.storage.close()
+    d = open_database(tmp_path)
+    holder = d.objects[holder.id]
+    thing = d.objects[thing.id]
+    holder.inventory.append(thing)
+    assert d.referrers(thing) == [(holder, holder._properties['inventory'])]
+    with raises(IsValueError):
+        d.destroy_object(thing)
+
+
+def test_container_changes(tmp_path):
+    d = open_database(tmp_path, cache_size=2)
+    first = d.create_object()
+    first.inventory = []
+    second = d.create_object()
+    second.inventory = []
+    d.storage.flush()
+    first.inventory.append(1)
+    for x in range(3):
+        d.create_object()
+    assert first.id not in d.storage.cache
+    second = d.objects[second.id]
+    second.inventory.append(2)
+    d.storage.close()
+    d = open_database(tmp_path)
+    assert d.objects[first.id].inventory == [1]
+    assert d.objects[second.id].inventory == [2]
+
+
+def test_lazy_references(tmp_path):
+    d = open_database(tmp_path)
+    room = d.create_object()
+    sword = d.create_object()
+    room.owner = sword
+    room.things = [sword, 5]
+    d.storage.close()
+    d = open_database(tmp_path)
+    room = d.objects[room.id]
+    assert list(d.storage.loaded) == [room.id]
+    assert d.find_references(room._properties['things'].value) == {sword.id}
+    assert d.dump_object(room)['properties'][1]['value'] == [
+        ObjectReference(sword.id), 5
+    ]
+    assert list(d.storage.loaded) == [room.id]
+    with raises(RuntimeError):
+        with d.transaction():
+            room.remove_property('owner')
+            raise RuntimeError()
+    sword = d.objects[sword.id]
+    assert room.owner is sword
+    assert room.things == [sword, 5]
+
+
+def test_deep_chain(tmp_path):
+    d = open_database(tmp_path)
+    previous = d.create_object()
+    for x in range(2999):
+        obj = d.create_object()
+        obj.add_property('previous', d.object_class, previous)
+        previous = obj
+    d.storage.close()
+    d = open_database(tmp_path, cache_size=100)
+    obj = d.objects[2999]
+    assert list(d.storage.loaded) == [2999]
+    assert obj.previous.id == 2998
+    assert list(d.storage.loaded) == [2999, 2998]
+    while obj.id:
+        obj = obj.previous
+    assert not d.storage.pending
+    assert len(d.storage.cache) == 100
+    collect()
+    assert len(d.storage.loaded) <= 101
+
+
+def test_evicted_resolution(tmp_path):
+    d = open_database(tmp_path, cache_size=2)
+    p = d.create_object()
+    c = d.create_object(p)
+    p.hp = 1
+    assert c.hp == 1
+    for x in range(2):
+        d.create_object()
+    assert p.id not in d.storage.cache
+    assert c.id not in d.storage.cache
+    assert d.storage.detached[c.id] is c
+    p.hp = 2
+    assert c.hp == 2
+    p.remove_property('hp')
+    assert not hasattr(c, 'hp')
+    assert d.objects[c.id] is c
+    assert c.id not in d.storage.detached
@@ -0,0 +1,215 @@
+"""Test transactions."""
+
+from asyncio import run, gather, sleep as asyncio_sleep, Event as AsyncEvent
+from threading import Thread, Event
+from pytest import raises
+from carehome import Database
+
+
+class Abort(Exception):
+    pass
+
+
+def make_world(d):
+    base = d.create_object()
+    base.add_method('def describe(self):\n    return "base"')
+    mixin = d.create_object()
+    room = d.create_object()
+    thing = d.create_object(base, mixin)
+    thing.location = room
+    thing.name = 'Thing'
+    thing.friends = [room]
+    d.register_object('room', room)
+    return (base, mixin, room, thing)
+
+
+def test_commit():
+    d = Database()
+    o = d.create_object()
+    with d.transaction():
+        o.name = 'Test'
+        assert d.undo_log
+    assert d.undo_log is None
+    assert o.name == 'Test'
+
+
+def test_rollback():
+    d = Database()
+    base, mixin, room, thing = make_world(d)
+    before = d.dump()
+    max_id = d.max_id
+    with raises(Abort):
+        with d.transaction():
+            thing.name = 'Changed'
+            thing.weight = 5
+            thing.remove_property('friends')
+            thing.remove_parent(base)
+            thing.add_parent(d.create_object())
+            thing.location = None
+            thing.add_method('def describe(self):\n    return "thing"')
+            base.add_method('def describe(self):\n    return "changed"')
+            base.remove_method('describe')
+            d.unregister_object('room')
+            d.register_object('thing', thing)
+            other = d.create_object(mixin)
+            other.location = room
+            d.destroy_object(other)
+            raise Abort()
+    assert d.undo_log is None
+    assert d.dump() == before
+    assert d.max_id > max_id
+    assert thing.parents == [base, mixin]
+    assert thing.describe() == 'base'
+    assert room.contents == [thing]
+    assert d.room is room
+    assert d.references[room.id] == {(thing.id, 'friends')}
+    assert max_id + 1 not in d.objects
+
+
+def test_destroy():
+    d = Database()
+    base, mixin, room, thing = make_world(d)
+    before = d.dump()
+    with raises(Abort):
+        with d.transaction():
+            thing.location = None
+            thing.name = 'Changed'
+            d.destroy_object(thing)
+            raise Abort()
+    assert d.objects[thing.id] is thing
+    assert thing.id not in d.destroyed
+    assert d.dump() == before
+    assert room.contents == [thing]
+    assert base.children == [thing]
+
+
+def test_no_events():
+    d = Database()
+    room = d.create_object()
+    room.entered = 0
+    room.add_method('def on_enter(self, room, thing):\n    self.entered += 1')
+    room.add_method('def on_exit(self, room, thing):\n    self.entered -= 1')
+    thing = d.create_object()
+    with raises(Abort):
+        with d.transaction():
+            thing.location = room
+            assert room.entered == 1
+            raise Abort()
+    assert thing.location is None
+    assert room.entered == 0
+
+
+def test_savepoints():
+    d = Database()
+    o = d.create_object()
+    o.name = 'First'
+    with d.transaction():
+        o.name = 'Second'
+        with raises(Abort):
+            with d.transaction():
+                o.name = 'Third'
+                o.other = 'Other'
+                raise Abort()
+        assert o.name == 'Second'
+        assert 'other' not in o._properties
+        assert len(d.undo_log) == 1
+    assert o.name == 'Second'
+    with raises(Abort):
+        with d.transaction():
+            o.name = 'Fourth'
+            with d.transaction():
+                o.name = 'Fifth'
+            raise Abort()
+    assert o.name == 'Second'
+
+
+def test_journal(tmp_path):
+    snapshot = str(tmp_path / 'snapshot.jsonl')
+    journal = str(tmp_path / 'journal.jsonl')
+    d = Database()
+    d.recover(snapshot, journal)
+    base, mixin, room, thing = make_world(d)
+    with raises(Abort):
+        with d.transaction():
+            thing.remove_parent(base)
+            thing.name = 'Changed'
+            d.create_object(base).location = room
+            raise Abort()
+    d.journal.sync()
+    new = Database()
+    new.recover(snapshot, journal)
+    assert new.dump() == d.dump()
+    assert new.objects[thing.id].parents == [
+        new.objects[base.id], new.objects[mixin.id]
+    ]
+
+
+def test_threads():
+    d = Database(threadsafe=True)
+    o = d.create_object()
+    o.hp = 1
+    opened = Event()
+    changed = Event()
+    committed = Event()
+    errors = []
+
+    def first():
+        with d.transaction():
+            o.name = 'First'
+            opened.set()
+            changed.wait()
+        committed.set()
+
+    def second():
+        opened.wait()
+        try:
+            with d.transaction():
+                o.hp = 3
+                changed.set()
+                committed.wait()
+                raise Abort()
+        except Abort:
+            pass
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=first), Thread(target=second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert o.hp == 1
+    assert o.name == 'First'
+    assert d.undo_log is None
+
+
+def test_tasks():
+    d = Database()
+    o = d.create_object()
+    o.hp = 1
+
+    async def main():
+        opened = AsyncEvent()
+        committed = AsyncEvent()
+
+        async def first():
+            with d.transaction():
+                o.name = 'First'
+                opened.set()
+                await committed.wait()
+
+        async def second():
+            await opened.wait()
+            with raises(Abort):
+                with d.transaction():
+                    o.hp = 3
+                    committed.set()
+                    await asyncio_sleep(0)
+                    raise Abort()
+
+        await gather(first(), second())
+
+    run(main())
+    assert o.hp == 1
+    assert o.name == 'First'